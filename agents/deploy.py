@@ -33,7 +33,7 @@ def deploy() -> None:
             "cloudpickle",
             "pydantic",
             "requests",
-            "beautifulsoup4",
+            "lxml",
             "google-api-python-client",
             "toolbox",
             "toolbox-core",
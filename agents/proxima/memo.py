@@ -0,0 +1,67 @@
+# tasks/common/memo.py と同じ内容
+# tasks と agents は別々にデプロイするため、それぞれに置いている。変更するときは両方を更新する
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class TtlMemo(Generic[T]):
+    """
+    関数の結果をキーごとにTTLの間だけ保持する (スレッドセーフ)
+    - 同じキーの計算が実行中なら、その結果を待って使う (同時に来た同じリクエストを1回にまとめる)
+    - 例外はキャッシュしない
+    - 件数の上限を超えたら、最も使われていないものから捨てる
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024) -> None:
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: OrderedDict[Hashable, tuple[float, T]] = OrderedDict()
+        self._in_flight: dict[Hashable, Future[T]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "waits": 0}
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], T]) -> T:
+        if self._ttl <= 0:
+            return compute()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if future is None:
+                future = Future()
+                self._in_flight[key] = future
+                self._stats["misses"] += 1
+            else:
+                self._stats["waits"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+            self._in_flight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
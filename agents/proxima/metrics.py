@@ -0,0 +1,50 @@
+# api/metrics.py と同じ内容
+# api と agents は別々にデプロイするため、それぞれに置いている。変更するときは両方を更新する
+import threading
+from typing import Any
+
+# レイテンシのヒストグラムのバケット (ミリ秒)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram:
+    """
+    名前ごとのレイテンシのヒストグラム
+    - 各バケットには、その値以下だった回数を数える (最後のバケットは上限なし)
+    """
+
+    def __init__(self, buckets_ms: tuple[int, ...] = LATENCY_BUCKETS_MS) -> None:
+        self._buckets_ms = buckets_ms
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict[str, Any]] = {}
+
+    def observe(self, name: str, seconds: float, error: bool = False) -> None:
+        elapsed_ms = seconds * 1000
+        with self._lock:
+            stats = self._stats.setdefault(
+                name, {"count": 0, "errors": 0, "sum_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(self._buckets_ms) + 1)}
+            )
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["sum_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            index = next((i for i, bound in enumerate(self._buckets_ms) if elapsed_ms <= bound), len(self._buckets_ms))
+            stats["buckets"][index] += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        """名前ごとの集計を返す"""
+        labels = [f"le_{bound}ms" for bound in self._buckets_ms] + ["inf"]
+        with self._lock:
+            return {
+                name: {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["sum_ms"] / stats["count"], 2),
+                    "max_ms": round(stats["max_ms"], 2),
+                    "buckets": dict(zip(labels, stats["buckets"], strict=True)),
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+tool_latency = LatencyHistogram()
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# 取得したページをそのまま使う秒数 (過ぎたら ETag / Last-Modified で再検証する。0で無効)
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "3600"))
+# プロセス内に保持する本文の合計文字数の上限。超えたら最も使われていないものから捨てる
+PAGE_CACHE_MAX_CHARS = int(os.getenv("PAGE_CACHE_MAX_CHARS", str(20 * 1024 * 1024)))
+
+
+@dataclass
+class CachedPage:
+    """URLごとに保存する、Webページから取り出した本文"""
+
+    url: str
+    text: str
+    etag: str | None = None
+    last_modified: str | None = None
+    # 最後に取得・再検証した時刻 (UNIX時間)
+    fetched_at: float = 0.0
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.fetched_at < ttl
+
+    def validators(self) -> dict[str, str]:
+        """条件付きリクエストのヘッダー"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """
+    URLごとのWebページの本文のキャッシュ (プロセス内で、会話・ユーザーをまたいで共有する)
+    - TTLを過ぎたページも再検証のために残しておき、合計文字数が上限を超えたら使われていないものから捨てる
+    """
+
+    def __init__(self, ttl: float = PAGE_CACHE_TTL, max_chars: int = PAGE_CACHE_MAX_CHARS) -> None:
+        self.ttl = ttl
+        self._max_chars = max_chars
+        self._pages: OrderedDict[str, CachedPage] = OrderedDict()
+        self._total_chars = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> CachedPage | None:
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            page = self._pages.get(url)
+            if page is not None:
+                self._pages.move_to_end(url)
+            return page
+
+    def set(self, page: CachedPage) -> None:
+        if self.ttl <= 0 or len(page.text) > self._max_chars:
+            return
+        with self._lock:
+            previous = self._pages.pop(page.url, None)
+            if previous is not None:
+                self._total_chars -= len(previous.text)
+            self._pages[page.url] = page
+            self._total_chars += len(page.text)
+            while self._total_chars > self._max_chars:
+                _, evicted = self._pages.popitem(last=False)
+                self._total_chars -= len(evicted.text)
+
+
+page_cache = PageCache()
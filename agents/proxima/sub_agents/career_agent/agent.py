@@ -11,6 +11,7 @@ from ...tools import (
     delete_initiative,
     google_search,
     search_career,
+    search_career_overview,
     search_initiatives,
     search_memory,
     update_career,
@@ -21,6 +22,7 @@ from . import prompt
 tools = [
     google_search,
     search_memory,
+    search_career_overview,
     search_career,
     add_career,
     update_career,
@@ -1,15 +1,23 @@
 import json
 import logging
 import os
-import re
+import random
 import sys
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
-from typing import Literal
+from dataclasses import replace
+from typing import Any, Literal
 
 import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from googleapiclient.discovery import build
+from requests.adapters import HTTPAdapter
+
+from .extract import charset_from_content_type, extract_text
+from .memo import TtlMemo
+from .metrics import LatencyHistogram
+from .page_cache import CachedPage, page_cache
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -25,20 +33,159 @@ os.environ["TOOL_API_SERVER_URL"] = "YOUR_ENV"
 API_KEY = os.getenv("GOOGLE_PROGRAMMABLE_SEARCH_API_KEY")
 CSE_ID = os.getenv("GOOGLE_PROGRAMMABLE_SEARCH_CSE_ID")
 TOOL_API_SERVER_URL = os.getenv("TOOL_API_SERVER_URL")
+# ツールサーバーへのリクエストのタイムアウト (秒) と、取得系の関数を再試行する回数
+TOOL_API_CONNECT_TIMEOUT = float(os.getenv("TOOL_API_CONNECT_TIMEOUT", "5"))
+TOOL_API_READ_TIMEOUT = float(os.getenv("TOOL_API_READ_TIMEOUT", "30"))
+TOOL_API_MAX_RETRIES = int(os.getenv("TOOL_API_MAX_RETRIES", "2"))
+TOOL_API_POOL_SIZE = int(os.getenv("TOOL_API_POOL_SIZE", "10"))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# google_search でWebページを取得するときのタイムアウト (秒)
+SCRAPE_CONNECT_TIMEOUT = float(os.getenv("SCRAPE_CONNECT_TIMEOUT", "5"))
+SCRAPE_READ_TIMEOUT = float(os.getenv("SCRAPE_READ_TIMEOUT", "10"))
+# 同じ検索クエリの結果を使い回す秒数 (0で無効) と、保持するクエリ数の上限
+GOOGLE_SEARCH_CACHE_TTL = float(os.getenv("GOOGLE_SEARCH_CACHE_TTL", "3600"))
+GOOGLE_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("GOOGLE_SEARCH_CACHE_MAX_ENTRIES", "1024"))
+GOOGLE_SEARCH_NUM_RESULTS = 3
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+# ツールごとのツールサーバーへのリクエストのレイテンシ (再試行を含めた全体の時間)
+_tool_latency = LatencyHistogram()
+# googleapiclient のサービスはスレッドセーフではないため、スレッドごとに1度だけ作成する
+_thread_local = threading.local()
+_search_memo: TtlMemo[list[dict[str, Any]]] = TtlMemo(GOOGLE_SEARCH_CACHE_TTL, GOOGLE_SEARCH_CACHE_MAX_ENTRIES)
+
+
+def _get_session() -> requests.Session:
+    """ツールサーバーへの接続を使い回すためのセッションを返す"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TOOL_API_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"accept": "application/json", "content-type": "application/json"})
+                _session = session
+    return _session
+
+
+def get_tool_latency_stats() -> dict[str, Any]:
+    """ツールごとのツールサーバーへのリクエストの回数・エラー数・平均/最大レイテンシ・ヒストグラム (ミリ秒) を返す"""
+    return _tool_latency.snapshot()
+
+
+def _error_payload(response: requests.Response) -> dict:
+    """
+    4xxの応答をツールの応答と同じ形にする (エラーの内容をエージェントがそのまま読めるようにする)
+    """
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {"detail": payload}
+    message = payload.get("message") or str(payload.get("detail") or response.text)
+    return {"status": "error", "message": message, "data": payload.get("data") or message}
+
+
+def _request_tool_api(path: str, body: dict, name: str, idempotent: bool) -> dict:
+    """
+    ツールサーバーにリクエストする
+    - 取得系 (idempotent) のリクエストは、接続エラー・タイムアウト・429/5xxのときにジッター付きの指数バックオフで再試行する
+    - 4xx (引数の誤りなど) は例外にせず、エラーの内容を返す
+    - 成功・4xx・5xx・接続エラー・タイムアウトのいずれの場合もレイテンシを記録する
+    """
+    max_attempts = TOOL_API_MAX_RETRIES + 1 if idempotent else 1
+    start_time = time.perf_counter()
+    for attempt in range(max_attempts):
+        last_attempt = attempt == max_attempts - 1
+        try:
+            response = _get_session().post(
+                f"{TOOL_API_SERVER_URL}{path}",
+                data=json.dumps(body),
+                timeout=(TOOL_API_CONNECT_TIMEOUT, TOOL_API_READ_TIMEOUT),
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if last_attempt:
+                _tool_latency.observe(name, time.perf_counter() - start_time, error=True)
+                raise
+            reason = str(e)
+        else:
+            if response.status_code not in RETRYABLE_STATUS_CODES or last_attempt:
+                elapsed = time.perf_counter() - start_time
+                _tool_latency.observe(name, elapsed, error=not response.ok)
+                logger.info(f"Tool API {name}: {response.status_code} {elapsed * 1000:.1f}ms")
+                if 400 <= response.status_code < 500:
+                    return _error_payload(response)
+                response.raise_for_status()
+                return response.json()
+            reason = f"status {response.status_code}"
+        backoff = random.uniform(0, 0.2 * 2**attempt)
+        logger.warning(f"Retrying {name} in {backoff:.2f}s (attempt {attempt + 1}): {reason}")
+        time.sleep(backoff)
+    raise RuntimeError("unreachable")
+
+
+def _post_data(body: dict, idempotent: bool = False) -> dict:
+    """ツールサーバーの/dataで関数を実行する"""
+    return _request_tool_api("/data", body, body["function_name"], idempotent)
 
 
 def _scrape_page(url: str) -> str:
     """
     Webページをスクレイピングする関数
     """
-    response = requests.get(url)
-    html = response.content
-    soup = BeautifulSoup(html, "html.parser")
-    text = soup.get_text()
-    text = re.sub(r"\n+", "\n", text)
+    # TTL以内に取得したページはリクエストせずに使い、過ぎていれば条件付きリクエストで再検証する
+    cached = page_cache.get(url)
+    if cached is not None and cached.is_fresh(page_cache.ttl):
+        return cached.text
+    headers = cached.validators() if cached is not None else {}
+    try:
+        response = requests.get(url, headers=headers, timeout=(SCRAPE_CONNECT_TIMEOUT, SCRAPE_READ_TIMEOUT))
+        if response.status_code == requests.codes.not_modified and cached is not None:
+            page_cache.set(replace(cached, fetched_at=time.time()))
+            return cached.text
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.warning(f"Failed to scrape {url}: {e}")
+        return cached.text if cached is not None else ""
+    text = extract_text(response.content, charset_from_content_type(response.headers.get("content-type")))
+    page_cache.set(
+        CachedPage(
+            url=url,
+            text=text,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+            fetched_at=time.time(),
+        )
+    )
     return text
 
 
+def _get_search_service() -> Any:
+    service = getattr(_thread_local, "search_service", None)
+    if service is None:
+        service = build("customsearch", "v1", developerKey=API_KEY)
+        _thread_local.search_service = service
+    return service
+
+
+def _search_items(query: str) -> list[dict[str, Any]]:
+    """
+    Custom Search APIで検索し、検索結果を返す
+    - 同じクエリはTTLの間は結果を使い回し、他の会話で実行中なら結果を待つ
+    """
+
+    def _search() -> list[dict[str, Any]]:
+        service = _get_search_service()
+        res = service.cse().list(q=query, cx=CSE_ID, start=1, num=GOOGLE_SEARCH_NUM_RESULTS, lr="lang_ja").execute()
+        return res.get("items", [])
+
+    return _search_memo.get_or_compute((" ".join(query.split()).casefold(), GOOGLE_SEARCH_NUM_RESULTS), _search)
+
+
 def google_search(query: str) -> str:
     """
     Google検索を行う関数
@@ -46,9 +193,9 @@ def google_search(query: str) -> str:
     :param query: 検索クエリ
     :return: 検索結果（Markdown形式）
     """
-    service = build("customsearch", "v1", developerKey=API_KEY)
-    res = service.cse().list(q=query, cx=CSE_ID, start=1, num=3, lr="lang_ja").execute()
-    items = res["items"]
+    items = _search_items(query)
+    if not items:
+        return ""
     urls = [item["link"] for item in items]
     titles = [item["title"] for item in items]
     with ThreadPoolExecutor(max_workers=len(items)) as executor:
@@ -66,12 +213,7 @@ def search_memory(user_id: str) -> str:
     """
     logger.info("Fetching personal info from memory")
     body = {"function_name": "search_memory", "args": {"user_id": user_id}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body, idempotent=True)
     personal_infomation = response_json["data"]
     return personal_infomation
 
@@ -91,12 +233,7 @@ def add_memory(
     """
     logger.info("Adding personal info into memory")
     body = {"function_name": "add_memory", "args": {"user_id": user_id, "content": content, "category": category}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -112,12 +249,7 @@ def update_memory(user_id: str, id_: str, content: str) -> str:
     """
     logger.info("Updating personal info into memory")
     body = {"function_name": "update_memory", "args": {"user_id": user_id, "id": id_, "content": content}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -130,12 +262,7 @@ def search_information(user_id: str) -> str:
         information: ユーザーの趣味思考にあった情報
     """
     body = {"function_name": "search_information", "args": {"user_id": user_id}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body, idempotent=True)
     information = response_json["data"]
     return information
 
@@ -149,12 +276,7 @@ def search_tasks(user_id: str) -> str:
     """
     logger.info(f"Fetching quests from information: {user_id}")
     body = {"function_name": "search_tasks", "args": {"user_id": user_id}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body, idempotent=True)
     tasks = response_json["data"]
     return tasks
 
@@ -182,12 +304,7 @@ def add_task(user_id: str, title: str, description: str, recommend: str, categor
             "estimated_time": estimated_time,
         },
     }
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -221,12 +338,7 @@ def update_task(
             "completed": completed,
         },
     }
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -236,12 +348,7 @@ def delete_task(user_id: str, id_: str) -> str:
     ユーザーのタスク（デイリークエスト）を削除する
     """
     body = {"function_name": "delete_task", "args": {"user_id": user_id, "id": id_}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -254,12 +361,7 @@ def search_career(user_id: str) -> str:
         career: ユーザーのキャリア目標
     """
     body = {"function_name": "search_career", "args": {"user_id": user_id}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body, idempotent=True)
     career = response_json["data"]
     return career
 
@@ -283,12 +385,7 @@ def add_career(user_id: str, career_title: str, career_description: str, target_
             "target_period": target_period,
         },
     }
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -315,12 +412,7 @@ def update_career(user_id: str, id_: str, career_title: str, career_description:
             "target_period": target_period,
         },
     }
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -334,12 +426,7 @@ def delete_career(user_id: str, id_: str) -> str:
         result: 結果メッセージ
     """
     body = {"function_name": "delete_career", "args": {"user_id": user_id, "id": id_}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -352,12 +439,7 @@ def search_initiatives(user_id: str) -> str:
         initiatives: ユーザーのキャリアの実現に向かって中期的に定めているプラン
     """
     body = {"function_name": "search_initiatives", "args": {"user_id": user_id}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body, idempotent=True)
     initiatives = response_json["data"]
     return initiatives
 
@@ -376,12 +458,7 @@ def add_initiative(user_id: str, title: str, body_text: str, target_period: str)
         "function_name": "add_initiative",
         "args": {"user_id": user_id, "title": title, "body": body_text, "target_period": target_period},
     }
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -401,12 +478,7 @@ def update_initiative(user_id: str, id_: str, title: str, body_text: str, target
         "function_name": "update_initiative",
         "args": {"user_id": user_id, "id": id_, "title": title, "body": body_text, "target_period": target_period},
     }
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
 
@@ -420,11 +492,43 @@ def delete_initiative(user_id: str, id_: str) -> str:
         result: 結果メッセージ
     """
     body = {"function_name": "delete_initiative", "args": {"user_id": user_id, "id": id_}}
-    response = requests.post(
-        f"{TOOL_API_SERVER_URL}/data",
-        headers={"accept": "application/json", "content-type": "application/json"},
-        data=json.dumps(body),
-    )
-    response_json = response.json()
+    response_json = _post_data(body)
     result = response_json["message"]
     return result
+
+
+def _post_data_batch(calls: list[tuple[str, dict]]) -> list[dict]:
+    """
+    複数の関数を/data/batchでまとめて実行する
+    - 1回のHTTPリクエストで実行し、結果は呼び出しと同じ順番で返す
+    - リクエスト全体が4xxで失敗した場合は、そのエラーをすべての呼び出しの結果として返す
+    """
+    body = {"requests": [{"function_name": name, "args": args} for name, args in calls]}
+    # 取得系の関数だけであれば再試行してよい
+    idempotent = all(name.startswith("search_") for name, _ in calls)
+    response_json = _request_tool_api("/data/batch", body, "batch", idempotent)
+    if "results" not in response_json:
+        return [response_json] * len(calls)
+    return response_json["results"]
+
+
+def search_career_overview(user_id: str) -> str:
+    """ユーザーの記憶・キャリア目標・中期的なプラン・タスクをまとめて取得する関数
+    キャリアの相談を始めるときなど、複数の情報が必要なときは個別に取得せずにこの関数を使う
+    Args:
+        user_id: <INFORMATION>タブ内で最初に与えられたユーザーID
+    Returns:
+        overview: ユーザーの記憶・キャリア目標・中期的なプラン・タスク
+    """
+    sections = [
+        ("記憶", "search_memory"),
+        ("キャリア目標", "search_career"),
+        ("中期的なプラン", "search_initiatives"),
+        ("タスク", "search_tasks"),
+    ]
+    results = _post_data_batch([(function_name, {"user_id": user_id}) for _, function_name in sections])
+    contents = []
+    for (title, _), result in zip(sections, results, strict=True):
+        data = result["data"] if result["status"] == "success" else f"取得に失敗しました: {result['message']}"
+        contents.append(f"# {title}\n{data}\n")
+    return "\n".join(contents)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from collections.abc import Coroutine
+from typing import Any
+
+from clients import get_agent
+
+logger = logging.getLogger(__name__)
+
+# ユーザーごとに作成しておく予備のセッション数 (0で無効)
+# 予備はAgent Engineにセッションとして作成されるため、必要なときだけ有効にする
+AGENT_SESSION_POOL_SIZE = int(os.getenv("AGENT_SESSION_POOL_SIZE", "0"))
+# 予備のセッションを保持するユーザー数の上限
+AGENT_SESSION_POOL_MAX_USERS = int(os.getenv("AGENT_SESSION_POOL_MAX_USERS", "256"))
+# 予備のセッションを使い回す期限 (秒)
+AGENT_SESSION_POOL_MAX_AGE = float(os.getenv("AGENT_SESSION_POOL_MAX_AGE", "3600"))
+
+
+async def create_agent_session(user_id: str) -> str:
+    """Agent Engine のセッションを作成し、session_idを返す"""
+    agent_session = await asyncio.to_thread(lambda: get_agent().create_session(user_id=user_id))
+    return agent_session["id"]
+
+
+async def delete_agent_session(user_id: str, agent_session_id: str) -> None:
+    """Agent Engine のセッションを削除する"""
+    await asyncio.to_thread(lambda: get_agent().delete_session(user_id=user_id, session_id=agent_session_id))
+
+
+class AgentSessionPool:
+    """
+    Agent Engine のセッションを事前に作成しておくプール
+    - Agent Engine のセッションはuser_idに紐づくため、ユーザーごとに予備を持つ
+    - 予備を使ったら、バックグラウンドで次の予備を作成する
+    - 期限切れやユーザー数の上限で捨てる予備は、Agent Engine からも削除する (削除しないとセッションが残り続ける)
+    """
+
+    def __init__(
+        self,
+        size: int = AGENT_SESSION_POOL_SIZE,
+        max_users: int = AGENT_SESSION_POOL_MAX_USERS,
+        max_age: float = AGENT_SESSION_POOL_MAX_AGE,
+    ) -> None:
+        self._size = size
+        self._max_users = max_users
+        self._max_age = max_age
+        self._spares: OrderedDict[str, deque[tuple[float, str]]] = OrderedDict()
+        self._refilling: set[str] = set()
+        # 実行中のタスクがGCされないように参照を持っておく
+        self._tasks: set[asyncio.Task] = set()
+
+    async def acquire(self, user_id: str) -> str:
+        """予備のセッションがあればそれを返し、なければ新しく作成する"""
+        agent_session_id = self._pop(user_id)
+        if agent_session_id is None:
+            agent_session_id = await create_agent_session(user_id)
+        else:
+            logger.info(f"Reused pooled Agent Session: {user_id}, {agent_session_id}")
+        self.prefill(user_id)
+        return agent_session_id
+
+    def prefill(self, user_id: str) -> None:
+        """予備のセッションが足りなければ、バックグラウンドで作成する"""
+        if self._size <= 0 or user_id in self._refilling:
+            return
+        if len(self._spares.get(user_id, ())) >= self._size:
+            return
+        self._refilling.add(user_id)
+        self._run_in_background(self._refill(user_id))
+
+    async def close(self) -> None:
+        """残っている予備のセッションをすべて削除する (終了時に呼び出す)"""
+        # 作成中の予備も削除できるように、作成が終わるのを待ってから削除する
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        while self._spares:
+            user_id, spares = self._spares.popitem(last=False)
+            self._discard(user_id, [agent_session_id for _, agent_session_id in spares])
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _run_in_background(self, coro: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _discard(self, user_id: str, agent_session_ids: list[str]) -> None:
+        """使わない予備のセッションを、バックグラウンドで Agent Engine から削除する"""
+        for agent_session_id in agent_session_ids:
+            self._run_in_background(self._delete(user_id, agent_session_id))
+
+    async def _delete(self, user_id: str, agent_session_id: str) -> None:
+        try:
+            await delete_agent_session(user_id, agent_session_id)
+        except Exception as e:
+            logger.warning(f"Failed to delete pooled Agent Session: {user_id}, {agent_session_id}: {e}")
+
+    def _pop(self, user_id: str) -> str | None:
+        spares = self._spares.get(user_id)
+        now = time.monotonic()
+        expired = []
+        agent_session_id = None
+        while spares:
+            created_at, spare_id = spares.popleft()
+            if now - created_at < self._max_age:
+                agent_session_id = spare_id
+                break
+            expired.append(spare_id)
+        self._discard(user_id, expired)
+        return agent_session_id
+
+    async def _refill(self, user_id: str) -> None:
+        try:
+            while len(self._spares.get(user_id, ())) < self._size:
+                agent_session_id = await create_agent_session(user_id)
+                self._spares.setdefault(user_id, deque()).append((time.monotonic(), agent_session_id))
+                self._spares.move_to_end(user_id)
+                while len(self._spares) > self._max_users:
+                    evicted_user_id, evicted = self._spares.popitem(last=False)
+                    self._discard(evicted_user_id, [evicted_id for _, evicted_id in evicted])
+        except Exception as e:
+            logger.warning(f"Failed to prefill Agent Session: {user_id}: {e}")
+        finally:
+            self._refilling.discard(user_id)
+
+
+session_pool = AgentSessionPool()
@@ -0,0 +1,110 @@
+"""
+api のコールドスタートのベンチマーク
+
+次の3つを計測する。
+- import: `import main` にかかる時間 (新しいプロセスで計測)
+- ready: uvicorn を起動してから /healthz が応答するまでの時間
+- first request: 起動直後の最初の /chat の応答時間 (--document を指定した場合)
+  処理済みのメッセージはスキップされるため、2回目以降はクライアントの初期化と読み込みだけを計測することになる
+
+使い方:
+    uv run python benchmarks/bench_cold_start.py --runs 5
+    uv run python benchmarks/bench_cold_start.py --document users/{user_id}/sessions/{session_id}/messages/{message_id}
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+from ulid import ulid
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+
+
+def measure_import() -> float:
+    """新しいプロセスで main を読み込み、かかった時間を返す"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT], cwd=API_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def _wait_until_ready(url: str, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"server did not become ready within {timeout} seconds")
+
+
+def _send_chat(url: str, document: str) -> float:
+    headers = {
+        "ce-id": ulid(),
+        "ce-type": "google.cloud.firestore.document.v1.created",
+        "ce-source": "//firestore.googleapis.com/projects/benchmark/databases/proxima",
+        "ce-specversion": "1.0",
+        "ce-document": document,
+        "content-type": "application/json",
+    }
+    start_time = time.perf_counter()
+    requests.post(url, headers=headers, data=b"{}", timeout=300)
+    return time.perf_counter() - start_time
+
+
+def measure_server(port: int, document: str | None, timeout: float) -> tuple[float, float | None]:
+    """uvicorn を起動し、応答できるまでの時間と最初の /chat の応答時間を返す"""
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=API_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_until_ready(f"http://127.0.0.1:{port}/healthz", timeout)
+        ready = time.perf_counter() - start_time
+        first_request = _send_chat(f"http://127.0.0.1:{port}/chat", document) if document else None
+        return ready, first_request
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _summary(values: list[float]) -> str:
+    return f"mean {statistics.mean(values):.3f}s / min {min(values):.3f}s / max {max(values):.3f}s"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold start benchmark for the api service")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--document", help="Firestore message path sent as the first /chat request")
+    args = parser.parse_args()
+
+    import_times = [measure_import() for _ in range(args.runs)]
+    print(f"import:        {_summary(import_times)}")
+
+    ready_times = []
+    first_request_times = []
+    for _ in range(args.runs):
+        ready, first_request = measure_server(args.port, args.document, args.timeout)
+        ready_times.append(ready)
+        if first_request is not None:
+            first_request_times.append(first_request)
+    print(f"ready:         {_summary(ready_times)}")
+    if first_request_times:
+        print(f"first request: {_summary(first_request_times)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+/chat の負荷ベンチマーク
+
+Eventarc と同じ形式 (binary mode の CloudEvent) で /chat にリクエストを送り、
+同時実行数ごとのスループットとレイテンシを計測する。
+
+ドキュメントファイルには、1行に1つFirestoreのメッセージのパスを書く。
+    users/{user_id}/sessions/{session_id}/messages/{message_id}
+処理済みのメッセージはスキップされるため、送るリクエスト数以上のドキュメントを用意する。
+
+使い方:
+    uv run python benchmarks/load_chat.py --url http://localhost:8080/chat --documents-file documents.txt
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from threading import Lock
+
+import requests
+from ulid import ulid
+
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16]
+
+
+def _send(url: str, document: str, timeout: float) -> tuple[float, int]:
+    """CloudEventを1件送り、経過時間とステータスコードを返す"""
+    headers = {
+        "ce-id": ulid(),
+        "ce-type": "google.cloud.firestore.document.v1.created",
+        "ce-source": "//firestore.googleapis.com/projects/benchmark/databases/proxima",
+        "ce-specversion": "1.0",
+        "ce-document": document,
+        "content-type": "application/json",
+    }
+    start_time = time.perf_counter()
+    try:
+        response = requests.post(url, headers=headers, data=b"{}", timeout=timeout)
+        status = response.status_code
+    except requests.RequestException:
+        status = 0
+    return time.perf_counter() - start_time, status
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    """パーセンタイルを返す"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run(url: str, documents: list[str], concurrency: int, requests_per_level: int, timeout: float) -> dict:
+    """指定した同時実行数でリクエストを送り、結果を集計する"""
+    document_iter = cycle(documents)
+    lock = Lock()
+
+    def _next_document() -> str:
+        with lock:
+            return next(document_iter)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: _send(url, _next_document(), timeout), range(requests_per_level)))
+    elapsed = time.perf_counter() - start_time
+
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, status in results if not 200 <= status < 300)
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": errors,
+        "throughput": len(results) / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": _percentile(latencies, 95),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load benchmark for /chat")
+    parser.add_argument("--url", default="http://localhost:8080/chat")
+    parser.add_argument("--documents-file", required=True)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    with open(args.documents_file) as f:
+        documents = [line.strip() for line in f if line.strip()]
+    if not documents:
+        raise SystemExit("documents file is empty")
+
+    print(f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50(s)':>8} {'p95(s)':>8}")
+    for concurrency in args.concurrency:
+        result = run(args.url, documents, concurrency, args.requests, args.timeout)
+        print(
+            f"{result['concurrency']:>11} {result['requests']:>8} {result['errors']:>6} "
+            f"{result['throughput']:>8.2f} {result['p50']:>8.2f} {result['p95']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+
+class BigQueryChatLogger:
+    """
+    chatのログをメモリ上にバッファし、バックグラウンドのスレッドからまとめてBigQueryに書き込む
+    - 件数 (batch_size) か経過時間 (flush_interval) のどちらかに達したらストリーミング挿入する
+    - 書き込みに失敗した場合は指数バックオフでリトライする
+    - プロセス終了時にはバッファに残ったログを書き込んでから終了する
+    - クライアントは最初に書き込むときにバックグラウンドのスレッドで作成する
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], "bigquery.Client"],
+        table_name: str,
+        batch_size: int = 100,
+        flush_interval: float = 2.0,
+        max_retries: int = 5,
+        max_queue_size: int = 10000,
+    ) -> None:
+        self._client_factory = client_factory
+        self._table_name = table_name
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._queue: queue.Queue[dict[str, Any]] = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def log(self, row: dict[str, Any]) -> None:
+        """ログをバッファに追加する (ブロックしない)"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            logger.warning(f"BigQuery log buffer is full, dropping row: {row.get('id')}")
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """バッファに残ったログを書き込んでからスレッドを停止する"""
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join(timeout=timeout)
+        if thread.is_alive():
+            logger.warning(f"BigQuery logger did not drain within {timeout} seconds: {self._queue.qsize()} rows left")
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="bq-chat-logger", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+
+    def _collect_batch(self) -> list[dict[str, Any]]:
+        batch: list[dict[str, Any]] = []
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if self._stop_event.is_set():
+                # 停止中は待たずにバッファに残っている分だけを取り出す
+                remaining = 0
+            elif remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: list[dict[str, Any]]) -> None:
+        rows = batch
+        for attempt in range(self._max_retries + 1):
+            try:
+                client = self._client_factory()
+                table_id = f"{client.project}.{self._table_name}"
+                errors = client.insert_rows_json(table_id, rows, row_ids=[row["id"] for row in rows])
+            except Exception as e:
+                logger.warning(f"Failed to insert chat logs into BigQuery (attempt {attempt + 1}): {e}")
+            else:
+                if not errors:
+                    return
+                logger.warning(f"BigQuery rejected {len(errors)} chat logs (attempt {attempt + 1}): {errors}")
+                # エラーになった行だけを再送する
+                rows = [rows[error["index"]] for error in errors if "index" in error] or rows
+            if attempt < self._max_retries:
+                time.sleep(min(2**attempt, 30) + random.uniform(0, 1))
+        logger.error(f"Dropped {len(rows)} chat logs after {self._max_retries} retries")
+
+
+def register_shutdown(chat_logger: BigQueryChatLogger) -> None:
+    """プロセス終了時にバッファを書き込むように登録する"""
+    atexit.register(chat_logger.shutdown)
@@ -0,0 +1,200 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Protocol
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの保存先: "memory" はプロセス内、"redis" はインスタンス間で共有する
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "memory")
+SEARCH_CACHE_REDIS_URL = os.getenv("SEARCH_CACHE_REDIS_URL", "redis://localhost:6379/0")
+# 検索結果をキャッシュする秒数 (0で無効)
+# プロセス内のキャッシュは他のインスタンスやサービス (Web・tasks) での更新を検知できないため、短めにしておく
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300" if SEARCH_CACHE_BACKEND == "redis" else "30"))
+# プロセス内のキャッシュに保持する件数の上限 (キーごとの世代も同じ件数まで保持する)
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024"))
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> str | None: ...
+
+    def generation(self, key: str) -> int: ...
+
+    def set(self, key: str, value: str, ttl: float, generation: int) -> None: ...
+
+    def invalidate(self, key: str) -> None: ...
+
+
+class InMemoryBackend:
+    """
+    プロセス内のキャッシュ (TTLと件数の上限を超えたら古いものから捨てる)
+    - キーごとの世代は invalidate で進め、読み込みを始めたときと世代が変わっていたら set しない
+    - 世代はプロセス全体で増え続ける番号を使い、件数の上限を超えたら使われていないものから捨てる
+      (捨てたキーの世代は、それまでに捨てた世代の最大値として扱うため、捨てる前に読み込みを始めた set は書き込まれない)
+    """
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_MAX_ENTRIES) -> None:
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._generations: OrderedDict[str, int] = OrderedDict()
+        self._last_generation = 0
+        self._evicted_generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _generation(self, key: str) -> int:
+        return self._generations.get(key, self._evicted_generation)
+
+    def generation(self, key: str) -> int:
+        with self._lock:
+            return self._generation(key)
+
+    def set(self, key: str, value: str, ttl: float, generation: int) -> None:
+        with self._lock:
+            if self._generation(key) != generation:
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._last_generation += 1
+            self._generations[key] = self._last_generation
+            self._generations.move_to_end(key)
+            while len(self._generations) > self._max_entries:
+                _, evicted = self._generations.popitem(last=False)
+                self._evicted_generation = max(self._evicted_generation, evicted)
+            self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """
+    インスタンス間で共有するキャッシュ (redis パッケージが必要)
+    - 世代は "{key}:gen" に保存し、比較と書き込みは Lua スクリプトでまとめて行う
+    """
+
+    _SET_IF_GENERATION = """
+    if (redis.call('GET', KEYS[2]) or '0') == ARGV[2] then
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[3])
+    end
+    """
+
+    def __init__(self, url: str = SEARCH_CACHE_REDIS_URL) -> None:
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._set_if_generation = self._client.register_script(self._SET_IF_GENERATION)
+
+    def get(self, key: str) -> str | None:
+        value = self._client.get(key)
+        return value.decode() if value is not None else None
+
+    def generation(self, key: str) -> int:
+        value = self._client.get(f"{key}:gen")
+        return int(value) if value is not None else 0
+
+    def set(self, key: str, value: str, ttl: float, generation: int) -> None:
+        self._set_if_generation(keys=[key, f"{key}:gen"], args=[value, str(generation), int(ttl * 1000)])
+
+    def invalidate(self, key: str) -> None:
+        pipeline = self._client.pipeline()
+        pipeline.incr(f"{key}:gen")
+        pipeline.delete(key)
+        pipeline.execute()
+
+
+class SearchCache:
+    """
+    ユーザーごとの検索結果 (整形済みの文字列) のキャッシュ
+    - キーは "{関数名}:{user_id}"
+    - 追加・更新・削除のときは invalidate で該当するキーを消して世代を進める
+    - DBから読み込む前に generation を取得し、set に渡す (読み込み中に更新された場合は書き戻さない)
+    - キャッシュの読み書きに失敗してもDBから取得できるように、例外は握りつぶす
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float = SEARCH_CACHE_TTL) -> None:
+        self._backend = backend
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, function_name: str, user_id: str) -> str | None:
+        if self._ttl <= 0:
+            return None
+        try:
+            value = self._backend.get(f"{function_name}:{user_id}")
+        except Exception as e:
+            logger.warning(f"Failed to read search cache: {e}")
+            value = None
+        with self._lock:
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return value
+
+    def generation(self, function_name: str, user_id: str) -> int:
+        """DBから読み込む前に取得し、set に渡す (読み込み中に invalidate されたら古い値を書き戻さない)"""
+        if self._ttl <= 0:
+            return 0
+        try:
+            return self._backend.generation(f"{function_name}:{user_id}")
+        except Exception as e:
+            logger.warning(f"Failed to read search cache generation: {e}")
+            return -1
+
+    def set(self, function_name: str, user_id: str, value: str, generation: int) -> None:
+        if self._ttl <= 0 or generation < 0:
+            return
+        try:
+            self._backend.set(f"{function_name}:{user_id}", value, self._ttl, generation)
+        except Exception as e:
+            logger.warning(f"Failed to write search cache: {e}")
+
+    def invalidate(self, function_name: str, user_id: str) -> None:
+        try:
+            self._backend.invalidate(f"{function_name}:{user_id}")
+        except Exception as e:
+            logger.warning(f"Failed to invalidate search cache: {e}")
+
+    def stats(self) -> dict[str, Any]:
+        """キャッシュのヒット数・ミス数・ヒット率を返す"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _create_backend() -> CacheBackend:
+    if SEARCH_CACHE_BACKEND == "redis":
+        try:
+            return RedisBackend()
+        except ImportError:
+            logger.warning("redis is not installed, falling back to the in-memory search cache")
+    return InMemoryBackend()
+
+
+search_cache = SearchCache(_create_backend())
@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, Generic, TypeVar
+
+from dotenv import load_dotenv
+from google.cloud import firestore
+
+if TYPE_CHECKING:
+    from google.cloud import bigquery
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Lazy(Generic[T]):
+    """初回の呼び出し時にだけ生成し、以降はプロセス内で使い回す"""
+
+    def __init__(self, name: str, factory: Callable[[], T]) -> None:
+        self._name = name
+        self._factory = factory
+        self._value: T | None = None
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+                    logger.info(f"{self._name} client initialized")
+        return self._value
+
+
+def _create_firestore() -> firestore.AsyncClient:
+    return firestore.AsyncClient(database="proxima")
+
+
+# vertexai と bigquery は読み込みに時間がかかるため、初期化するときに読み込む
+def _create_agent() -> Any:
+    import vertexai
+    from vertexai import agent_engines
+
+    vertexai.init(
+        project=os.getenv("GOOGLE_CLOUD_PROJECT"),
+        location=os.getenv("AGENT_ENGINE_LOCATION"),
+        staging_bucket=os.getenv("GOOGLE_CLOUD_STORAGE_BUCKETS"),
+    )
+    return agent_engines.get(os.getenv("ADK_AGENT_ENGINE_ID"))
+
+
+def _create_bigquery() -> "bigquery.Client":
+    import google.auth
+    import google.auth.transport.requests
+    from google.cloud import bigquery
+
+    credentials, project_id = google.auth.default()
+    credentials.refresh(google.auth.transport.requests.Request())
+    return bigquery.Client(project=project_id, credentials=credentials)
+
+
+_firestore = _Lazy("Firestore", _create_firestore)
+_agent = _Lazy("Agent Engine", _create_agent)
+_bigquery = _Lazy("BigQuery", _create_bigquery)
+
+
+def get_firestore() -> firestore.AsyncClient:
+    """Firestore (AsyncClient) を返す"""
+    return _firestore.get()
+
+
+def get_agent() -> Any:
+    """Agent Engine のハンドルを返す"""
+    return _agent.get()
+
+
+def get_bigquery() -> "bigquery.Client":
+    """BigQuery のクライアントを返す"""
+    return _bigquery.get()
+
+
+def warm_up() -> None:
+    """
+    起動後にクライアントを初期化しておく
+    - 最初のリクエストで初期化を待たないようにするため、lifespanからバックグラウンドで呼び出す
+    """
+    for name, getter in [("Firestore", get_firestore), ("Agent Engine", get_agent), ("BigQuery", get_bigquery)]:
+        try:
+            getter()
+        except Exception as e:
+            logger.warning(f"Failed to warm up {name} client: {e}")
@@ -0,0 +1,85 @@
+import logging
+from datetime import UTC, datetime, timedelta
+
+from google.cloud import firestore
+from google.cloud.firestore import AsyncDocumentReference, AsyncTransaction
+
+logger = logging.getLogger(__name__)
+
+# ダイジェストに保持する会話の上限
+DIGEST_MAX_AGE = timedelta(days=2)
+DIGEST_MAX_MESSAGES = 200
+DIGEST_MAX_CHARS = 20000
+
+
+def _digest_ref(db: firestore.AsyncClient, user_id: str) -> AsyncDocumentReference:
+    """
+    ユーザーごとの会話ダイジェストのドキュメント
+    - Firestoreのパス: users/{userId}/digests/conversation
+    """
+    return db.collection("users", user_id, "digests").document("conversation")
+
+
+def _trim(entries: list[dict], now: datetime) -> list[dict]:
+    """
+    古すぎるエントリを削除し、新しいものからメッセージ数と文字数の上限まで残す
+    """
+    threshold = now - DIGEST_MAX_AGE
+    fresh = [entry for entry in entries if entry.get("createdAt") and entry["createdAt"] >= threshold]
+
+    kept: list[dict] = []
+    total_chars = 0
+    for entry in reversed(fresh):
+        content_length = len(entry.get("content") or "")
+        if len(kept) >= DIGEST_MAX_MESSAGES or total_chars + content_length > DIGEST_MAX_CHARS:
+            break
+        kept.append(entry)
+        total_chars += content_length
+    return list(reversed(kept))
+
+
+async def append_to_digest(db: firestore.AsyncClient, user_id: str, session_id: str, messages: list[tuple[str, str]]) -> None:
+    """
+    会話ダイジェストにメッセージ (role, content) を追記する
+    - 追記と同時に古いエントリを削除するため、ダイジェストのサイズは一定以下に保たれる
+    """
+    if not messages:
+        return
+    now = datetime.now(UTC)
+    new_entries = [
+        {"sessionId": session_id, "role": role, "content": content, "createdAt": now} for role, content in messages if content
+    ]
+    if not new_entries:
+        return
+
+    ref = _digest_ref(db, user_id)
+
+    @firestore.async_transactional
+    async def _append(transaction: AsyncTransaction) -> None:
+        snapshot = await ref.get(transaction=transaction)
+        entries = (snapshot.to_dict() or {}).get("entries", []) if snapshot.exists else []
+        transaction.set(ref, {"entries": _trim(entries + new_entries, now), "updatedAt": firestore.SERVER_TIMESTAMP})
+
+    await _append(db.transaction())
+
+
+async def read_digest(db: firestore.AsyncClient, user_id: str, exclude_session_id: str) -> str | None:
+    """
+    会話ダイジェストから過去の会話履歴のテキストを作成する
+    - ダイジェストがまだ作成されていないユーザーの場合はNoneを返す
+    """
+    snapshot = await _digest_ref(db, user_id).get()
+    if not snapshot.exists:
+        return None
+    entries = _trim((snapshot.to_dict() or {}).get("entries", []), datetime.now(UTC))
+
+    # セッションごとにまとめる (エントリは古い順に並んでいる)
+    sessions: dict[str, list[str]] = {}
+    for entry in entries:
+        entry_session_id = entry.get("sessionId")
+        if entry_session_id == exclude_session_id:
+            continue
+        created_at_str = entry["createdAt"].strftime("%Y-%m-%d %H:%M")
+        sessions.setdefault(entry_session_id, []).append(f"[{created_at_str}] {entry.get('role')}: {entry.get('content')}")
+
+    return "\n".join("\n------\n".join(conversations) for conversations in sessions.values())
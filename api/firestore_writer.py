@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from typing import Any
+
+from google.cloud import firestore
+from google.cloud.firestore import AsyncCollectionReference, AsyncDocumentReference
+
+logger = logging.getLogger(__name__)
+
+# 書き込みをまとめる時間 (秒)
+COALESCE_WINDOW = 0.2
+# バッチのコミットに失敗したときに再試行する回数 (それでも失敗したら1件ずつ書き込む)
+COMMIT_MAX_RETRIES = 2
+
+
+class MessageWriteError(Exception):
+    """まとめた書き込みの一部をFirestoreに保存できなかった"""
+
+
+class MessageWriteCoalescer:
+    """
+    ストリーミング中のメッセージへの書き込みを短い時間まとめて、Firestoreのバッチ書き込みで送る
+    - 同じドキュメントへの連続したupdateは1つにまとめる
+    - 作成待ちのドキュメントへのupdateは作成内容にまとめる
+    - 1つのバッチで作成するドキュメントは1つまでにする
+      (同じバッチ内ではSERVER_TIMESTAMPが同じ値になり、createdAtでの並び順が崩れるため)
+    - コミットに失敗したら再試行し、それでも失敗したら1件ずつ書き込んで、保存できたものだけでも残す
+    """
+
+    def __init__(self, db: firestore.AsyncClient, window: float = COALESCE_WINDOW) -> None:
+        self._db = db
+        self._window = window
+        self._commit_lock = asyncio.Lock()
+        self._creates: dict[str, tuple[AsyncDocumentReference, dict[str, Any]]] = {}
+        self._updates: dict[str, tuple[AsyncDocumentReference, dict[str, Any]]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_tasks: set[asyncio.Task] = set()
+        # バックグラウンドのコミットで保存できなかった書き込み (次のflushで呼び出し元に伝える)
+        self._error: MessageWriteError | None = None
+
+    async def create(self, collection_ref: AsyncCollectionReference, data: dict[str, Any]) -> AsyncDocumentReference:
+        """ドキュメントの作成を予約し、作成されるドキュメントの参照を返す"""
+        if self._creates:
+            await self.flush()
+        doc_ref = collection_ref.document()
+        self._creates[doc_ref.path] = (doc_ref, dict(data))
+        self._schedule()
+        return doc_ref
+
+    def update(self, doc_ref: AsyncDocumentReference, data: dict[str, Any]) -> None:
+        """ドキュメントの更新を予約する"""
+        if doc_ref.path in self._creates:
+            self._creates[doc_ref.path][1].update(data)
+        elif doc_ref.path in self._updates:
+            self._updates[doc_ref.path][1].update(data)
+        else:
+            self._updates[doc_ref.path] = (doc_ref, dict(data))
+        self._schedule()
+
+    async def flush(self) -> None:
+        """
+        予約されている書き込みをまとめてコミットする
+        - 保存できなかった書き込みがあればMessageWriteErrorを送出する
+          (バックグラウンドのコミットで保存できなかったものも、ここで送出する)
+        """
+        await self._commit_pending()
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    async def _commit_pending(self) -> None:
+        async with self._commit_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            creates = list(self._creates.values())
+            updates = list(self._updates.values())
+            self._creates.clear()
+            self._updates.clear()
+            if not (creates or updates):
+                return
+            for attempt in range(COMMIT_MAX_RETRIES + 1):
+                batch = self._db.batch()
+                for doc_ref, data in updates:
+                    batch.update(doc_ref, data)
+                for doc_ref, data in creates:
+                    batch.set(doc_ref, data)
+                try:
+                    await batch.commit()
+                    return
+                except Exception as e:
+                    logger.warning(f"Error committing coalesced message writes (attempt {attempt + 1}): {e}")
+                if attempt < COMMIT_MAX_RETRIES:
+                    await asyncio.sleep(0.2 * 2**attempt)
+
+            # バッチは1件でも失敗すると全体が保存されないため、1件ずつ書き込んで保存できるものは残す
+            failed_paths = []
+            for doc_ref, data in updates:
+                try:
+                    await doc_ref.update(data)
+                except Exception as e:
+                    logger.error(f"Error updating message {doc_ref.path}: {e}")
+                    failed_paths.append(doc_ref.path)
+            for doc_ref, data in creates:
+                try:
+                    await doc_ref.set(data)
+                except Exception as e:
+                    logger.error(f"Error creating message {doc_ref.path}: {e}")
+                    failed_paths.append(doc_ref.path)
+            if failed_paths:
+                self._error = MessageWriteError(f"Failed to write {len(failed_paths)} messages: {failed_paths}")
+
+    def _schedule(self) -> None:
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._window, self._flush_in_background)
+
+    def _flush_in_background(self) -> None:
+        self._timer = None
+        task = asyncio.create_task(self._commit_pending())
+        # タスクがGCされないように参照を保持する
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
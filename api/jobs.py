@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_CLOUD_RUN_FUNCTIONS_URI = os.getenv("GOOGLE_CLOUD_RUN_FUNCTIONS_URI")
+# ジョブの送信先: "http" は Cloud Run Functions、"local" はプロセス内のキュー (ローカル検証・テスト用)
+JOB_DISPATCHER = os.getenv("JOB_DISPATCHER", "http")
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "300"))
+
+
+@dataclass
+class JobResult:
+    """ジョブの実行結果"""
+
+    name: str
+    status_code: int
+    text: str
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 300
+
+
+@dataclass
+class QueuedJob:
+    """ローカルキューに積まれたジョブ"""
+
+    name: str
+    payload: dict[str, Any] = field(default_factory=dict)
+
+
+class HttpJobDispatcher:
+    """Cloud Run Functions にリクエストしてジョブを実行する"""
+
+    def __init__(self, base_uri: str | None = GOOGLE_CLOUD_RUN_FUNCTIONS_URI, timeout: float = JOB_TIMEOUT) -> None:
+        self._base_uri = base_uri
+        self._timeout = timeout
+
+    async def run(self, name: str, payload: dict[str, Any]) -> JobResult:
+        try:
+            response = await asyncio.to_thread(
+                requests.post,
+                f"{self._base_uri}/{name}",
+                json=payload,
+                headers={"Content-Type": "application/json"},
+                timeout=self._timeout,
+            )
+        except requests.RequestException as e:
+            return JobResult(name=name, status_code=0, text=str(e))
+        return JobResult(name=name, status_code=response.status_code, text=response.text)
+
+
+class LocalJobQueue:
+    """
+    Cloud Run Functions の代わりにジョブをキューに積むだけのディスパッチャー
+    - 積まれたジョブは `queue` から取り出して確認できる
+    """
+
+    def __init__(self) -> None:
+        self.queue: asyncio.Queue[QueuedJob] = asyncio.Queue()
+
+    async def run(self, name: str, payload: dict[str, Any]) -> JobResult:
+        await self.queue.put(QueuedJob(name=name, payload=dict(payload)))
+        return JobResult(name=name, status_code=200, text="queued")
+
+
+class JobRunner:
+    """
+    後続のジョブを実行する
+    - run: 結果を待つ
+    - submit: 結果を待たずにバックグラウンドで実行する (fire-and-forget)
+    """
+
+    def __init__(self, dispatcher: HttpJobDispatcher | LocalJobQueue) -> None:
+        self._dispatcher = dispatcher
+        # 実行中のタスクがGCされないように参照を持っておく
+        self._background_tasks: set[asyncio.Task] = set()
+
+    async def run(self, name: str, payload: dict[str, Any]) -> JobResult:
+        result = await self._dispatcher.run(name, payload)
+        if result.ok:
+            logger.info(f"{name} response: {result.status_code} {result.text}")
+        else:
+            logger.error(f"{name} failed: {result.status_code} {result.text}")
+        return result
+
+    def submit(self, name: str, payload: dict[str, Any]) -> asyncio.Task:
+        task = asyncio.create_task(self.run(name, payload))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background job failed: {task.exception()}")
+
+    async def drain(self) -> None:
+        """バックグラウンドで実行中のジョブがすべて終わるまで待つ"""
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+
+
+def _create_dispatcher() -> HttpJobDispatcher | LocalJobQueue:
+    if JOB_DISPATCHER == "local":
+        return LocalJobQueue()
+    return HttpJobDispatcher()
+
+
+jobs = JobRunner(_create_dispatcher())
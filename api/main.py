@@ -1,28 +1,42 @@
+import asyncio
 import logging
-import os
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
-import vertexai
 from cloudevents.http import from_http
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
-from vertexai import agent_engines
 
-from services import chat
+from agent_sessions import session_pool
+from clients import warm_up
+from jobs import jobs
+from services import chat, chat_logger
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-app = FastAPI()
 
-vertexai.init(
-    project=os.getenv("GOOGLE_CLOUD_PROJECT"),
-    location=os.getenv("AGENT_ENGINE_LOCATION"),
-    staging_bucket=os.getenv("GOOGLE_CLOUD_STORAGE_BUCKETS"),
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # 起動を待たせないように、クライアントの初期化はバックグラウンドで行う
+    warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    yield
+    await warm_up_task
+    # バックグラウンドのジョブとBigQueryへのログをすべて書き込んでから終了する
+    await jobs.drain()
+    chat_logger.shutdown()
+    # 使われなかった予備のAgent Engineセッションを残さない
+    await session_pool.close()
 
-agent = agent_engines.get(os.getenv("ADK_AGENT_ENGINE_ID"))
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/healthz")
+async def healthz() -> dict[str, str]:
+    return {"status": "ok"}
 
 
 @app.post("/chat")
@@ -1,21 +1,20 @@
+import asyncio
 import json
 import logging
-import os
 import random
 import time
+from collections.abc import AsyncIterator, Awaitable
 from datetime import UTC, datetime, timedelta, timezone
+from typing import Any
 
-import google.auth
-import google.auth.transport.requests
-import requests
-import vertexai
 from dotenv import load_dotenv
-from google import genai
-from google.cloud import bigquery, firestore
-from google.cloud.firestore import CollectionReference, DocumentReference, DocumentSnapshot
+from google.cloud import firestore
+from google.cloud.firestore import AsyncCollectionReference, AsyncDocumentReference, DocumentSnapshot
 from ulid import ulid
-from vertexai import agent_engines
 
+from agent_sessions import session_pool
+from bq_logger import BigQueryChatLogger, register_shutdown
+from clients import get_agent, get_bigquery, get_firestore
 from constants.messages import (
     CREATE_QUEST_FAILED_MESSAGE,
     FIRST_GREET_MESSAGE_1,
@@ -25,7 +24,10 @@ from constants.messages import (
     FIRST_GREET_MESSAGE_5,
 )
 from db import search_information, search_memory, search_tasks
+from digest import append_to_digest, read_digest
+from firestore_writer import MessageWriteCoalescer
 from information_instruction import INFORMATION_INSTRUCTION
+from jobs import jobs
 
 JST = timezone(timedelta(hours=+9), "JST")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
@@ -33,20 +35,9 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-db = firestore.Client(database="proxima")
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
-
-vertexai.init(
-    project=os.getenv("GOOGLE_CLOUD_PROJECT"),
-    location=os.getenv("AGENT_ENGINE_LOCATION"),
-    staging_bucket=os.getenv("GOOGLE_CLOUD_STORAGE_BUCKETS"),
-)
-
-agent = agent_engines.get(os.getenv("ADK_AGENT_ENGINE_ID"))
-
-credentials, project_id = google.auth.default()
-credentials.refresh(google.auth.transport.requests.Request())
-bq_client = bigquery.Client(project=project_id, credentials=credentials)
+# クライアントは最初に使うときに作成する (clients.py)
+chat_logger = BigQueryChatLogger(get_bigquery, "proxima.chat")
+register_shutdown(chat_logger)
 
 
 AGENT_NAME_MAP = {
@@ -54,42 +45,37 @@ AGENT_NAME_MAP = {
     "quest_agent": "Kaede",
     "proxima_agent": "Misaki",
 }
-GOOGLE_CLOUD_RUN_FUNCTIONS_URI = os.getenv("GOOGLE_CLOUD_RUN_FUNCTIONS_URI")
+
+# 過去の会話履歴としてプロンプトに含める上限
+PAST_CHATS_MAX_SESSIONS = 20
+PAST_CHATS_MAX_MESSAGES = 200
+PAST_CHATS_MAX_CHARS = 20000
+
 
 def _save_bq_chat(user_id: str, session_id: str, agent_session_id: str, content: str, content_type: str, meta: dict) -> None:
-    """BigQueryにchatを保存する"""
-    table_id = f"{project_id}.proxima.chat"
-    id_ = ulid()
-    meta_json = json.dumps(meta)
-
-    # パラメータ化されたクエリを使用
-    query = f"""
-    INSERT INTO `{table_id}` (id, user_id, session_id, agent_session_id, content, content_type, meta, created_at)
-    VALUES (?, ?, ?, ?, ?, ?, PARSE_JSON(?), CURRENT_TIMESTAMP())
     """
-
-    # パラメータを配列として渡す
-    params = [
-        id_,
-        user_id,
-        session_id,
-        agent_session_id,
-        content,
-        content_type,
-        meta_json,
-    ]
-
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter(None, "STRING", param) for param in params]
+    BigQueryにchatを保存する
+    - バッファに追加するだけで、書き込みはバックグラウンドでまとめて行う
+    """
+    chat_logger.log(
+        {
+            "id": ulid(),
+            "user_id": user_id,
+            "session_id": session_id,
+            "agent_session_id": agent_session_id,
+            "content": content,
+            "content_type": content_type,
+            "meta": json.dumps(meta),
+            "created_at": datetime.now(UTC).isoformat(),
+        }
     )
 
-    bq_client.query(query, job_config=job_config).result()
-    return
-
 
-def _add_thinking_message(sessions_ref: CollectionReference, session_id: str, now_agent_name: str) -> DocumentReference:
+async def _add_thinking_message(
+    sessions_ref: AsyncCollectionReference, session_id: str, now_agent_name: str
+) -> AsyncDocumentReference:
     """考え中のstatusをFirestoreに保存する"""
-    _, answer_ref = (
+    _, answer_ref = await (
         sessions_ref.document(session_id)
         .collection("messages")
         .add(
@@ -107,106 +93,224 @@ def _add_thinking_message(sessions_ref: CollectionReference, session_id: str, no
     return answer_ref
 
 
-def _send_middle_message(
-    sessions_ref: CollectionReference,
+async def _send_middle_message(
+    writer: MessageWriteCoalescer,
+    sessions_ref: AsyncCollectionReference,
     session_id: str,
-    answer_ref: DocumentReference,
+    answer_ref: AsyncDocumentReference,
     middle_message: dict,
     now_agent_name: str,
     create_new_message: bool = True,
-) -> DocumentReference:
+) -> AsyncDocumentReference:
     """
     途中のメッセージの場合、一度answer_refを更新してから、新しい考え中を表すメッセージを送信する
     functionCallの場合はfunctionResponseで上書きしたいのでcreate_new_message=Falseにする
+    書き込みはwriterでまとめて行う
     """
-    answer_ref.update(middle_message)
+    writer.update(answer_ref, middle_message)
     if create_new_message:
-        _, answer_ref = (
-            sessions_ref.document(session_id)
-            .collection("messages")
-            .add(
-                {
-                    "id": ulid(),
-                    "content": "",
-                    "loading": True,
-                    "role": "model",
-                    "status": "thinking",
-                    "agent": now_agent_name,
-                    "processing": True,
-                    "createdAt": firestore.SERVER_TIMESTAMP,
-                }
-            )
+        answer_ref = await writer.create(
+            sessions_ref.document(session_id).collection("messages"),
+            {
+                "id": ulid(),
+                "content": "",
+                "loading": True,
+                "role": "model",
+                "status": "thinking",
+                "agent": now_agent_name,
+                "processing": True,
+                "createdAt": firestore.SERVER_TIMESTAMP,
+            },
         )
     return answer_ref
 
 
-def _create_agent_session(session_doc_ref: DocumentReference, user_id: str) -> str:
+async def _create_agent_session(session_doc_ref: AsyncDocumentReference, user_id: str) -> str:
     """
     Agent Engine のセッションを作成する
     - Agent Engine のsession_idは、Agent Engineで発行される
     - そこで、session_idのマッピングをFirestoreで管理する
+    - 事前に作成しておいたセッションがあればそれを使う
     """
-    agent_session = agent.create_session(user_id=user_id)
-    agent_session_id = agent_session["id"]
-    session_doc_ref.set({"agentSessionId": agent_session_id, "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+    agent_session_id = await session_pool.acquire(user_id)
+    await session_doc_ref.set({"agentSessionId": agent_session_id, "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
     logger.info(f"Issued Agent Session ID: {agent_session_id}")
     return agent_session_id
 
 
-def _remember(sessions_ref: CollectionReference, session_id: str, user_id: str) -> tuple[str, str, str]:
+async def _stream_query(user_id: str, session_id: str, message: str) -> AsyncIterator[dict]:
+    """
+    Agent Engine のストリーミング応答を非同期に受け取る
+    - stream_queryは同期のジェネレータのため、別スレッドで読み進めてイベントループに受け渡す
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[Any] = asyncio.Queue()
+    end_of_stream = object()
+
+    def _produce() -> None:
+        try:
+            for event in get_agent().stream_query(user_id=user_id, session_id=session_id, message=message):
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, end_of_stream)
+
+    producer = loop.run_in_executor(None, _produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is end_of_stream:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        await producer
+
+
+async def _stream_query_in_session(
+    session_doc_ref: AsyncDocumentReference, user_id: str, agent_session_id: str, message: str, reused: bool
+) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Agent Engine のストリーミング応答を、使ったセッションIDとともに受け取る
+    - 使い回したセッションが最初の応答の前に失敗した場合は、新しいセッションを作成して再試行する
+    """
+    received = False
+    try:
+        async for event in _stream_query(user_id, agent_session_id, message):
+            received = True
+            yield agent_session_id, event
+        return
+    except Exception as e:
+        if received or not reused:
+            raise
+        logger.warning(f"Agent Session is not available, creating a new one: {agent_session_id}: {e}")
+
+    agent_session_id = await _create_agent_session(session_doc_ref, user_id)
+    async for event in _stream_query(user_id, agent_session_id, message):
+        yield agent_session_id, event
+
+
+async def _fetch_session_conversations(sessions_ref: AsyncCollectionReference, session_id: str) -> list[str]:
+    """
+    セッション内の直近のメッセージを新しい順に取得する
+    """
+    messages = (
+        sessions_ref.document(session_id)
+        .collection("messages")
+        .select(["role", "content", "createdAt"])
+        .order_by("createdAt", direction=firestore.Query.DESCENDING)
+        .limit(PAST_CHATS_MAX_MESSAGES)
+        .stream()
+    )
+
+    conversations = []
+    async for msg in messages:
+        msg_data = msg.to_dict()
+        role = msg_data.get("role")
+        content = msg_data.get("content")
+        created_at = msg_data.get("createdAt")
+        if created_at:
+            created_at_str = created_at.strftime("%Y-%m-%d %H:%M")
+            conversations.append(f"[{created_at_str}] {role}: {content}")
+    return conversations
+
+
+async def _fetch_past_chats(sessions_ref: AsyncCollectionReference, session_id: str) -> str:
+    """
+    Firestore の過去のセッションから過去の会話履歴を取得する
+    - 直近のセッションから順に、メッセージ数と文字数の上限に達するまで詰める
+    - セッションごとのメッセージ取得は並列に行う
+    """
+    two_days_ago = datetime.now(UTC) - timedelta(days=2)
+
+    sessions = (
+        sessions_ref.where("createdAt", ">=", two_days_ago)
+        .order_by("createdAt", direction=firestore.Query.DESCENDING)
+        .limit(PAST_CHATS_MAX_SESSIONS + 1)
+        .stream()
+    )
+    session_ids = [session.id async for session in sessions if session.id != session_id][:PAST_CHATS_MAX_SESSIONS]
+    if not session_ids:
+        return ""
+
+    # セッションごとのメッセージを並列に取得する (新しいセッション順)
+    sessions_conversations = await asyncio.gather(*[_fetch_session_conversations(sessions_ref, id_) for id_ in session_ids])
+
+    past_chats = []
+    total_messages = 0
+    total_chars = 0
+    for conversations in sessions_conversations:
+        kept = []
+        for conversation in conversations:
+            if total_messages >= PAST_CHATS_MAX_MESSAGES or total_chars + len(conversation) > PAST_CHATS_MAX_CHARS:
+                break
+            kept.append(conversation)
+            total_messages += 1
+            total_chars += len(conversation)
+        if kept:
+            # 古い順に並べ直す
+            past_chats.append("\n------\n".join(reversed(kept)))
+        if len(kept) < len(conversations):
+            break
+
+    return "\n".join(reversed(past_chats))
+
+
+async def _load_past_chats(sessions_ref: AsyncCollectionReference, session_id: str, user_id: str) -> str:
+    """
+    会話ダイジェストから過去の会話履歴を取得する
+    - ダイジェストがまだないユーザーの場合は過去のセッションを直接読み込む
+    """
+    past_chats_text = await read_digest(get_firestore(), user_id, session_id)
+    if past_chats_text is None:
+        logger.info(f"Digest not found, scanning past sessions: {user_id}")
+        return await _fetch_past_chats(sessions_ref, session_id)
+    return past_chats_text
+
+
+async def _save_digest(user_id: str, session_id: str, messages: list[tuple[str, str]]) -> None:
+    """会話ダイジェストに今回の会話を追記する"""
+    try:
+        await append_to_digest(get_firestore(), user_id, session_id, messages)
+    except Exception as e:
+        logger.error(f"Error appending to digest: {e}")
+
+
+async def _timed(name: str, awaitable: Awaitable[str]) -> str:
+    """処理を待ち、経過時間をログに出す"""
+    start_time = time.time()
+    result = await awaitable
+    logger.info(f"*** Remember elapsed time: {name}: {time.time() - start_time} seconds")
+    return result
+
+
+async def _remember(sessions_ref: AsyncCollectionReference, session_id: str, user_id: str) -> tuple[str, str, str]:
     """
     DBからユーザーの過去の情報を取得する
     - Cloud SQL からユーザーのpreferencesを取得する
+    - Cloud SQL からユーザーのイベントまたはデイリークエストを取得する
     - Firestore の過去のセッションから過去の会話履歴を取得する
+    これらは互いに独立しているため並列に実行する
     """
     logger.info(f"*** Remember elapsed time")
     start_time = time.time()
-    # Cloud SQL からユーザーのpreferencesを取得する
-    preferences = search_memory(user_id)
-    search_memory_time = time.time()
-    logger.info(f"*** Remember elapsed time: search_memory: {search_memory_time - start_time} seconds")
 
     selected_theme = random.choice(["events", "quests"])
     if selected_theme == "events":
         # Cloud SQL からユーザーのイベントを取得する
-        theme_content = search_information(user_id)
+        theme_task = _timed("search_information", asyncio.to_thread(search_information, user_id))
     else:
         # Cloud SQL からユーザーのデイリークエストを取得する
-        theme_content = search_tasks(user_id)
-    search_tasks_time = time.time()
-    logger.info(f"*** Remember elapsed time: search_tasks or information: {search_tasks_time - search_memory_time} seconds")
-
-    # Firestore の過去のセッションから過去の会話履歴を取得する
-    two_days_ago = datetime.now(UTC) - timedelta(days=2)
-
-    # 一度にすべてのセッションとメッセージを取得
-    sessions = sessions_ref.where("createdAt", ">=", two_days_ago).stream()
-    past_chats = []
-
-    for session in sessions:
-        if session.id == session_id:
-            continue
+        theme_task = _timed("search_tasks", asyncio.to_thread(search_tasks, user_id))
 
-        # セッション内のすべてのメッセージを一度に取得
-        messages = sessions_ref.document(session.id).collection("messages").order_by("createdAt").stream()
-
-        conversations = []
-        for msg in messages:
-            msg_data = msg.to_dict()
-            role = msg_data.get("role")
-            content = msg_data.get("content")
-            created_at = msg_data.get("createdAt")
-            if created_at:
-                created_at_str = created_at.strftime("%Y-%m-%d %H:%M")
-                conversations.append(f"[{created_at_str}] {role}: {content}")
-
-        if conversations:
-            past_chats.append("\n------\n".join(conversations))
-
-    past_chats_text = "\n".join(past_chats)
-
-    past_chats_time = time.time()
-    logger.info(f"*** Remember elapsed time: past_chats: {past_chats_time - search_tasks_time} seconds")
+    preferences, theme_content, past_chats_text = await asyncio.gather(
+        _timed("search_memory", asyncio.to_thread(search_memory, user_id)),
+        theme_task,
+        _timed("past_chats", _load_past_chats(sessions_ref, session_id, user_id)),
+    )
+    logger.info(f"*** Remember elapsed time: total: {time.time() - start_time} seconds")
 
     logger.info(
         {"_remember": {"past_chats_text": past_chats_text, "preferences": preferences, "theme_content": theme_content}}
@@ -217,13 +321,13 @@ def _remember(sessions_ref: CollectionReference, session_id: str, user_id: str)
 
 async def chat(event_id: str, user_id: str, session_id: str, message_id: str) -> None:
     """チャットを実行する"""
-    sessions_ref = db.collection("users", user_id, "sessions")
+    sessions_ref = get_firestore().collection("users", user_id, "sessions")
 
-    session_doc_ref: DocumentReference = sessions_ref.document(session_id)
-    session_doc: DocumentSnapshot = session_doc_ref.get()
-
-    message_ref: DocumentReference = session_doc_ref.collection("messages").document(message_id)
-    message: DocumentSnapshot = message_ref.get()
+    session_doc_ref: AsyncDocumentReference = sessions_ref.document(session_id)
+    message_ref: AsyncDocumentReference = session_doc_ref.collection("messages").document(message_id)
+    session_doc: DocumentSnapshot
+    message: DocumentSnapshot
+    session_doc, message = await asyncio.gather(session_doc_ref.get(), message_ref.get())
     content: str = message.get("content")
     now_agent_name: str = message.get("agent")
 
@@ -235,7 +339,7 @@ async def chat(event_id: str, user_id: str, session_id: str, message_id: str) ->
         if processing_flag:
             logger.info(f"Skip message from model: {message_id}")
             return
-    message_ref.set({"processing": True}, merge=True)
+    await message_ref.set({"processing": True}, merge=True)
 
     if message.get("role") == "model":
         # sessionFirstGreetがまだdoneに設定されていなければ/receive_greetを実行する
@@ -249,15 +353,18 @@ async def chat(event_id: str, user_id: str, session_id: str, message_id: str) ->
             logger.info(f"Skip message from model: {message_id}")
         return
 
-    answer_ref = _add_thinking_message(sessions_ref, session_id, now_agent_name)
+    answer_ref = await _add_thinking_message(sessions_ref, session_id, now_agent_name)
 
     agent_session_id: str | None = session_doc.get("agentSessionId")
 
+    # 会話ダイジェストに追記するメッセージ
+    digest_messages: list[tuple[str, str]] = [("user", content)]
+
     # 本来であれば/greetでセッションを作成しているはずだが、/greetが実行されなかった場合はここを通る
     if not agent_session_id:
         logger.warning(f"Agent Session ID not found: {user_id}, {session_id}")
-        agent_session_id = _create_agent_session(session_doc_ref, user_id)
-        preferences, past_chats_text, theme_content = _remember(sessions_ref, session_id, user_id)
+        agent_session_id = await _create_agent_session(session_doc_ref, user_id)
+        preferences, past_chats_text, theme_content = await _remember(sessions_ref, session_id, user_id)
         now = datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S")
         content = (
             INFORMATION_INSTRUCTION.replace("$DATETIME$", now)
@@ -269,13 +376,12 @@ async def chat(event_id: str, user_id: str, session_id: str, message_id: str) ->
         )
     _save_bq_chat(user_id, session_id, agent_session_id, content, "user", {})
 
+    # ストリーミング中のFirestoreへの書き込みをまとめる
+    writer = MessageWriteCoalescer(get_firestore())
+
     # Agent Engine へのリクエスト
     try:
-        for event in agent.stream_query(
-            user_id=user_id,
-            session_id=agent_session_id,
-            message=content,
-        ):
+        async for event in _stream_query(user_id, agent_session_id, content):
             parts = event["content"]["parts"]
             logger.info(f"parts: {parts}")
             for part in parts:
@@ -287,46 +393,64 @@ async def chat(event_id: str, user_id: str, session_id: str, message_id: str) ->
                     middle_message = {"content": response, "loading": False, "status": "success"}
                     # 通常の応答生成の場合はlen(parts) == 1, function callingの場合はlen(parts) == 3 となる
                     if len(parts) == 1:
-                        answer_ref.update(middle_message)
+                        writer.update(answer_ref, middle_message)
                     else:
-                        answer_ref = _send_middle_message(sessions_ref, session_id, answer_ref, middle_message, now_agent_name)
+                        answer_ref = await _send_middle_message(
+                            writer, sessions_ref, session_id, answer_ref, middle_message, now_agent_name
+                        )
+                    # テキストの応答はユーザーがすぐに読めるように書き込む
+                    await writer.flush()
+                    digest_messages.append(("model", response))
                     _save_bq_chat(user_id, session_id, agent_session_id, response, "response", {})
                 if function_call:
                     middle_message = {"functionCall": function_call, "loading": False, "status": "success"}
                     if function_call.get("name") == "transfer_to_agent":
                         agent_name = function_call.get("args", {}).get("agent_name")
                         now_agent_name = AGENT_NAME_MAP[agent_name]
-                    answer_ref = _send_middle_message(
-                        sessions_ref, session_id, answer_ref, middle_message, now_agent_name, create_new_message=False
+                    answer_ref = await _send_middle_message(
+                        writer, sessions_ref, session_id, answer_ref, middle_message, now_agent_name, create_new_message=False
                     )
                     _save_bq_chat(user_id, session_id, agent_session_id, "", "function_call", function_call)
                 if function_response:
                     middle_message = {"functionResponse": function_response, "loading": False, "status": "success"}
-                    answer_ref = _send_middle_message(sessions_ref, session_id, answer_ref, middle_message, now_agent_name)
+                    answer_ref = await _send_middle_message(
+                        writer, sessions_ref, session_id, answer_ref, middle_message, now_agent_name
+                    )
                     _save_bq_chat(user_id, session_id, agent_session_id, "", "function_response", function_response)
     except Exception as e:
         logger.error(f"Error in chat: {e}")
+    finally:
+        await writer.flush()
+
+    await _save_digest(user_id, session_id, digest_messages)
 
     logger.info(f"Processed chat: {event_id}, {user_id}, {session_id}, {message_id}, {response}")
 
     return
 
 
-async def greet(event_id: str, user_id: str, session_id: str, message_ref: DocumentReference, now_agent_name: str) -> None:
+async def greet(
+    event_id: str, user_id: str, session_id: str, message_ref: AsyncDocumentReference, now_agent_name: str
+) -> None:
     """Greet APIを実行する"""
     logger.info(f"Received '/greet' request: {event_id}, {user_id}, {session_id}")
 
     # セッションを設定
-    sessions_ref = db.collection("users", user_id, "sessions")
-    session_doc_ref: DocumentReference = sessions_ref.document(session_id)
+    sessions_ref = get_firestore().collection("users", user_id, "sessions")
+    session_doc_ref: AsyncDocumentReference = sessions_ref.document(session_id)
 
     # 考え中のメッセージを更新する
     answer_ref = message_ref
 
-    agent_session_id = _create_agent_session(session_doc_ref, user_id)
+    # すでにAgent Engineのセッションがあれば使い回す
+    session_doc = await session_doc_ref.get()
+    agent_session_id: str = (session_doc.to_dict() or {}).get("agentSessionId") or ""
+    reused_session = bool(agent_session_id)
+    if not reused_session:
+        agent_session_id = await _create_agent_session(session_doc_ref, user_id)
 
     # ユーザーの情報を取得
-    preferences, past_chats_text, theme_content = _remember(sessions_ref, session_id, user_id)
+    preferences, past_chats_text, theme_content = await _remember(sessions_ref, session_id, user_id)
     now = datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S")
     content = (
         INFORMATION_INSTRUCTION.replace("$DATETIME$", now)
@@ -337,22 +461,33 @@ async def greet(event_id: str, user_id: str, session_id: str, message_ref: Docum
     )
     logger.info(f"/greet: content: {content}")
 
+    # greet では同じメッセージを上書きしていくため、最後の応答をダイジェストに追記する
+    last_response = ""
+    # 同じメッセージへの連続した上書きをまとめる
+    writer = MessageWriteCoalescer(get_firestore())
     try:
         # Agent Engine へのリクエスト
-        for event in agent.stream_query(
-            user_id=user_id,
-            session_id=agent_session_id,
-            message=content,
+        async for active_session_id, event in _stream_query_in_session(
+            session_doc_ref, user_id, agent_session_id, content, reused_session
         ):
+            # 再利用したセッションが使えずに作り直した場合は、新しいセッションIDで記録する
+            agent_session_id = active_session_id
             parts = event["content"]["parts"]
             # greet の場合は、text のみを返し、function_call は無視する
             if len(parts) > 0:
                 response = parts[0].get("text")
                 if response:
-                    answer_ref.update({"content": response, "loading": False, "status": "success", "agent": now_agent_name})
+                    writer.update(
+                        answer_ref, {"content": response, "loading": False, "status": "success", "agent": now_agent_name}
+                    )
+                    last_response = response
                     _save_bq_chat(user_id, session_id, agent_session_id, response, "greet", {})
     except Exception as e:
         logger.error(f"Error in chat: {e}")
+    finally:
+        await writer.flush()
+
+    await _save_digest(user_id, session_id, [("model", last_response)])
 
     _save_bq_chat(user_id, session_id, agent_session_id, content, "greet_input", {})
     logger.info(f"/greet: Processed greet: {event_id}, {user_id}, {session_id}")
@@ -360,42 +495,54 @@ async def greet(event_id: str, user_id: str, session_id: str, message_ref: Docum
     return
 
 
-def get_session_count(user_id: str) -> int:
+async def get_session_count(user_id: str) -> int:
     """ユーザーのセッション数を取得する"""
-    sessions_ref = db.collection("users", user_id, "sessions")
-    return len(sessions_ref.get())
+    sessions_ref = get_firestore().collection("users", user_id, "sessions")
+    return len(await sessions_ref.get())
 
 
 async def first_greet(
-    event_id: str, user_id: str, session_id: str, message_ref: DocumentReference, now_agent_name: str
+    event_id: str, user_id: str, session_id: str, message_ref: AsyncDocumentReference, now_agent_name: str
 ) -> None:
     """チュートリアル後の最初のGreet APIを実行する"""
     logger.info(f"Received '/first_greet' request: {event_id}, {user_id}, {session_id}")
 
     # ユーザーのstatusとfirstGreetを変更する
-    doc_ref = db.document("users", user_id)
-    doc_ref.update({"firstGreet": "doing", "status": "created"})
+    doc_ref = get_firestore().document("users", user_id)
+    await doc_ref.update({"firstGreet": "doing", "status": "created"})
+
+    sessions_ref = get_firestore().collection("users", user_id, "sessions")
+    session_doc_ref: AsyncDocumentReference = sessions_ref.document(session_id)
+
+    # チュートリアルのメッセージを送っている間に、タスク作成とAgentのセッション作成を進めておく
+    # - タスク作成: Cloud Functionsのcreate_questsにリクエストする (結果をメッセージで伝えるため待つ)
+    # - ニュースの作成: Cloud Functionsのcrawl_eventsにリクエストする (結果は待たない)
+    create_quest_task = asyncio.create_task(jobs.run("create-quest", {"user_id": user_id}))
+    agent_session_task = asyncio.create_task(_create_agent_session(session_doc_ref, user_id))
+    jobs.submit("crawl-events", {"user_id": user_id})
 
-    sessions_ref = db.collection("users", user_id, "sessions")
     answer_ref = message_ref
+    # チュートリアルのメッセージは1通ずつ表示したいので、送信ごとにflushする
+    writer = MessageWriteCoalescer(get_firestore())
     for i, message in enumerate([FIRST_GREET_MESSAGE_1, FIRST_GREET_MESSAGE_2, FIRST_GREET_MESSAGE_3]):
-        answer_ref = _send_middle_message(
-            sessions_ref, session_id, answer_ref, {"content": message, "loading": False, "status": "success"}, now_agent_name
+        answer_ref = await _send_middle_message(
+            writer,
+            sessions_ref,
+            session_id,
+            answer_ref,
+            {"content": message, "loading": False, "status": "success"},
+            now_agent_name,
         )
+        await writer.flush()
         if i < 2:
-            time.sleep(random.randint(2, 5))
-
-    session_doc_ref: DocumentReference = sessions_ref.document(session_id)
-    _ = _create_agent_session(session_doc_ref, user_id)
-
-    # タスク作成: Cloud Functionsのcreate_questsにリクエストする
-    response = requests.post(
-        f"{GOOGLE_CLOUD_RUN_FUNCTIONS_URI}/create-quest",
-        json={"user_id": user_id},
-        headers={"Content-Type": "application/json"},
-    )
-    if response.status_code == 200:
-        answer_ref = _send_middle_message(
+            await asyncio.sleep(random.randint(2, 5))
+
+    create_quest_result, _ = await asyncio.gather(create_quest_task, agent_session_task)
+    # アドバイスの生成: 作成されたタスクを使うので、タスク作成の後に依頼する (成否にかかわらず依頼し、結果は待たない)
+    jobs.submit("advice", {"user_id": user_id})
+    if create_quest_result.ok:
+        answer_ref = await _send_middle_message(
+            writer,
             sessions_ref,
             session_id,
             answer_ref,
@@ -403,18 +550,20 @@ async def first_greet(
             now_agent_name,
         )
     else:
-        logger.error(f"create-quest failed: {response.text}")
-        answer_ref = _send_middle_message(
+        answer_ref = await _send_middle_message(
+            writer,
             sessions_ref,
             session_id,
             answer_ref,
             {"content": CREATE_QUEST_FAILED_MESSAGE, "loading": False, "status": "success"},
             now_agent_name,
         )
+    await writer.flush()
 
     # 終了メッセージ
-    time.sleep(1)
-    _ = _send_middle_message(
+    await asyncio.sleep(1)
+    _ = await _send_middle_message(
+        writer,
         sessions_ref,
         session_id,
         answer_ref,
@@ -422,37 +571,22 @@ async def first_greet(
         now_agent_name,
         create_new_message=False,
     )
+    await writer.flush()
 
-    # ニュースの作成: Cloud Functionsのcreate_newsにリクエストする
-    response = requests.post(
-        f"{GOOGLE_CLOUD_RUN_FUNCTIONS_URI}/crawl-events",
-        json={"user_id": user_id},
-        headers={"Content-Type": "application/json"},
-    )
-    logger.info(f"crawl-events response: {response.status_code} {response.text}")
-
-    # アドバイスの生成: Cloud Functionsのadviceにリクエストする
-    response = requests.post(
-        f"{GOOGLE_CLOUD_RUN_FUNCTIONS_URI}/advice",
-        json={"user_id": user_id},
-        headers={"Content-Type": "application/json"},
-    )
-    logger.info(f"advice response: {response.status_code} {response.text}")
-
-    doc_ref.update({"firstGreet": "done"})
+    await doc_ref.update({"firstGreet": "done"})
 
     return
 
 
 async def receive_greet(
-    event_id: str, user_id: str, session_id: str, message_ref: DocumentReference, now_agent_name: str
+    event_id: str, user_id: str, session_id: str, message_ref: AsyncDocumentReference, now_agent_name: str
 ) -> None:
     """Greet APIを実行する"""
     logger.info(f"Received '/receive_greet' request: {event_id}, {user_id}, {session_id}")
 
     # firestoreのfirstGreet次第で実行する関数を分ける
-    doc_ref = db.document("users", user_id)
-    doc_snapshot = doc_ref.get()
+    doc_ref = get_firestore().document("users", user_id)
+    doc_snapshot = await doc_ref.get()
     first_greet_status = (doc_snapshot.to_dict() or {}).get("firstGreet")
 
     # firstGreetが存在しない場合は待つ
@@ -466,7 +600,7 @@ async def receive_greet(
         await greet(event_id, user_id, session_id, message_ref, now_agent_name)
 
     # sessionFirstGreetを更新する
-    session_doc_ref = db.collection("users", user_id, "sessions").document(session_id)
-    session_doc_ref.set({"sessionFirstGreet": "done"}, merge=True)
+    session_doc_ref = get_firestore().collection("users", user_id, "sessions").document(session_id)
+    await session_doc_ref.set({"sessionFirstGreet": "done"}, merge=True)
 
     return
@@ -1,106 +1,109 @@
+import asyncio
 import logging
+import os
+import time
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 from fastapi import FastAPI
-from pydantic import BaseModel
-
-from db import (
-    add_career,
-    add_initiative,
-    add_memory,
-    add_task,
-    delete_career,
-    delete_initiative,
-    delete_task,
-    search_career,
-    search_information,
-    search_initiatives,
-    search_memory,
-    search_tasks,
-    update_career,
-    update_initiative,
-    update_memory,
-    update_task,
-)
+from pydantic import ValidationError
+
+from cache import search_cache
+from db import dispose_async_engine, get_pool_stats
+from metrics import tool_latency
+from tool_registry import TOOLS
+from type.tool import BatchDataRequest, BatchDataResponse, DataRequest, DataResponse
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-app = FastAPI()
+# DBへのアクセス方法: "sync" はスレッドプールでpg8000、"async" はイベントループ上でasyncpgを使う
+TOOL_DB_MODE = os.getenv("TOOL_DB_MODE", "sync")
+# DBにアクセスする関数を実行するスレッド数 (コネクションプールの上限に合わせる)
+TOOL_MAX_WORKERS = int(
+    os.getenv("TOOL_MAX_WORKERS", str(int(os.getenv("DB_POOL_SIZE", "5")) + int(os.getenv("DB_MAX_OVERFLOW", "5"))))
+)
+# /data/batch で1度に受け付ける関数の数
+TOOL_MAX_BATCH_SIZE = int(os.getenv("TOOL_MAX_BATCH_SIZE", "20"))
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
 
 
-class DataRequest(BaseModel):
-    function_name: str
-    args: dict
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+    await dispose_async_engine()
 
 
-class DataResponse(BaseModel):
-    status: str
-    message: str
-    data: str | None = None
+app = FastAPI(lifespan=lifespan)
 
 
-@app.post("/data", response_model=DataResponse)
-async def execute_sql(request: DataRequest) -> DataResponse:
+async def _run_tool(request: DataRequest) -> DataResponse:
+    """
+    登録された関数を実行する
+    - 同期版のDBアクセスは、イベントループを止めないようにスレッドプールで実行する
+    """
     function_name = request.function_name
-    args = request.args
     if "user_id" not in request.args:
         return DataResponse(status="error", message="user_id is required")
 
-    user_id = request.args["user_id"]
-    logger.info(f"Received '/data' request: {function_name=}, {args=}")
+    tool = TOOLS.get(function_name)
+    if tool is None:
+        return DataResponse(status="error", message=f"Unknown function {function_name}")
+
+    try:
+        args = tool.args_model.model_validate(request.args)
+    except ValidationError as e:
+        return DataResponse(status="error", message=f"Invalid args for {function_name}: {e}")
+
+    start_time = time.perf_counter()
     try:
-        if request.function_name == "search_memory":
-            result = search_memory(user_id)
-        elif request.function_name == "add_memory":
-            result = add_memory(user_id, args["content"], args["category"])
-        elif request.function_name == "update_memory":
-            result = update_memory(user_id, args["id"], args["content"])
-        elif request.function_name == "search_information":
-            result = search_information(user_id)
-        elif request.function_name == "search_tasks":
-            result = search_tasks(user_id)
-        elif request.function_name == "add_task":
-            result = add_task(
-                user_id, args["title"], args["description"], args["recommend"], args["category"], args["estimated_time"]
-            )
-        elif request.function_name == "update_task":
-            result = update_task(
-                user_id,
-                args["id"],
-                args["title"],
-                args["description"],
-                args["recommend"],
-                args["category"],
-                args["estimated_time"],
-                args["completed"],
-            )
-        elif request.function_name == "delete_task":
-            result = delete_task(user_id, args["id"])
-        elif request.function_name == "search_career":
-            result = search_career(user_id)
-        elif request.function_name == "add_career":
-            result = add_career(user_id, args["career_title"], args["career_description"], args["target_period"])
-        elif request.function_name == "update_career":
-            result = update_career(
-                user_id, args["id"], args["career_title"], args["career_description"], args["target_period"]
-            )
-        elif request.function_name == "delete_career":
-            result = delete_career(user_id, args["id"])
-        elif request.function_name == "search_initiatives":
-            result = search_initiatives(user_id)
-        elif request.function_name == "add_initiative":
-            result = add_initiative(user_id, args["title"], args["body"], args["target_period"])
-        elif request.function_name == "update_initiative":
-            result = update_initiative(user_id, args["id"], args["title"], args["body"], args["target_period"])
-        elif request.function_name == "delete_initiative":
-            result = delete_initiative(user_id, args["id"])
+        if TOOL_DB_MODE == "async":
+            result = await tool.async_handler(args)
         else:
-            return DataResponse(status="error", message=f"Unknown function {request.function_name}")
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(_tool_executor, tool.handler, args)
     except Exception as e:
+        tool_latency.observe(function_name, time.perf_counter() - start_time, error=True)
         logger.error(f"Error in '/data' request: {e}")
         return DataResponse(status="error", message=str(e))
+    tool_latency.observe(function_name, time.perf_counter() - start_time)
+
+    return DataResponse(status="success", message=f"Successfully executed {function_name}", data=result)
+
+
+@app.post("/data", response_model=DataResponse)
+async def execute_sql(request: DataRequest) -> DataResponse:
+    logger.info(f"Received '/data' request: {request.function_name=}, {request.args=}")
+    return await _run_tool(request)
+
+
+@app.post("/data/batch", response_model=BatchDataResponse)
+async def execute_sql_batch(request: BatchDataRequest) -> BatchDataResponse:
+    """
+    複数の関数をまとめて実行する
+    - 各関数はコネクションプールを使って並列に実行し、結果はリクエストと同じ順番で返す
+    - 1つの関数が失敗しても、他の関数の結果は返す
+    """
+    function_names = [r.function_name for r in request.requests]
+    logger.info(f"Received '/data/batch' request: {function_names=}")
+    if len(request.requests) > TOOL_MAX_BATCH_SIZE:
+        error = DataResponse(status="error", message=f"Too many functions in a batch (max {TOOL_MAX_BATCH_SIZE})")
+        return BatchDataResponse(results=[error] * len(request.requests))
+    results = await asyncio.gather(*[_run_tool(r) for r in request.requests])
+    return BatchDataResponse(results=list(results))
+
+
+@app.get("/pool-stats")
+async def pool_stats() -> dict:
+    """Cloud SQLのコネクションプールの統計情報を返す"""
+    return get_pool_stats()
+
 
-    return DataResponse(status="success", message=f"Successfully executed {request.function_name}", data=result)
+@app.get("/metrics")
+async def metrics() -> dict:
+    """関数ごとのレイテンシ・コネクションプール・検索結果のキャッシュの統計情報を返す"""
+    return {"tools": tool_latency.snapshot(), "pool": get_pool_stats(), "search_cache": search_cache.stats()}
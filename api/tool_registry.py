@@ -0,0 +1,147 @@
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any
+
+from db import (
+    add_career,
+    add_career_async,
+    add_initiative,
+    add_initiative_async,
+    add_memory,
+    add_memory_async,
+    add_task,
+    add_task_async,
+    delete_career,
+    delete_career_async,
+    delete_initiative,
+    delete_initiative_async,
+    delete_task,
+    delete_task_async,
+    search_career,
+    search_career_async,
+    search_information,
+    search_information_async,
+    search_initiatives,
+    search_initiatives_async,
+    search_memory,
+    search_memory_async,
+    search_tasks,
+    search_tasks_async,
+    update_career,
+    update_career_async,
+    update_initiative,
+    update_initiative_async,
+    update_memory,
+    update_memory_async,
+    update_task,
+    update_task_async,
+)
+from type.tool import (
+    AddCareerArgs,
+    AddInitiativeArgs,
+    AddMemoryArgs,
+    AddTaskArgs,
+    TargetArgs,
+    UpdateCareerArgs,
+    UpdateInitiativeArgs,
+    UpdateMemoryArgs,
+    UpdateTaskArgs,
+    UserArgs,
+)
+
+
+@dataclass(frozen=True)
+class Tool:
+    """/data で呼び出せる関数と、その引数のモデル (handlerは同期版、async_handlerは非同期版のDBアクセス)"""
+
+    args_model: type[UserArgs]
+    handler: Callable[[Any], str]
+    async_handler: Callable[[Any], Awaitable[str]]
+
+
+TOOLS: dict[str, Tool] = {
+    "search_memory": Tool(
+        UserArgs,
+        lambda a: search_memory(a.user_id),
+        lambda a: search_memory_async(a.user_id),
+    ),
+    "add_memory": Tool(
+        AddMemoryArgs,
+        lambda a: add_memory(a.user_id, a.content, a.category),
+        lambda a: add_memory_async(a.user_id, a.content, a.category),
+    ),
+    "update_memory": Tool(
+        UpdateMemoryArgs,
+        lambda a: update_memory(a.user_id, a.id_, a.content),
+        lambda a: update_memory_async(a.user_id, a.id_, a.content),
+    ),
+    "search_information": Tool(
+        UserArgs,
+        lambda a: search_information(a.user_id),
+        lambda a: search_information_async(a.user_id),
+    ),
+    "search_tasks": Tool(
+        UserArgs,
+        lambda a: search_tasks(a.user_id),
+        lambda a: search_tasks_async(a.user_id),
+    ),
+    "add_task": Tool(
+        AddTaskArgs,
+        lambda a: add_task(a.user_id, a.title, a.description, a.recommend, a.category, a.estimated_time),
+        lambda a: add_task_async(a.user_id, a.title, a.description, a.recommend, a.category, a.estimated_time),
+    ),
+    "update_task": Tool(
+        UpdateTaskArgs,
+        lambda a: update_task(
+            a.user_id, a.id_, a.title, a.description, a.recommend, a.category, a.estimated_time, a.completed
+        ),
+        lambda a: update_task_async(
+            a.user_id, a.id_, a.title, a.description, a.recommend, a.category, a.estimated_time, a.completed
+        ),
+    ),
+    "delete_task": Tool(
+        TargetArgs,
+        lambda a: delete_task(a.user_id, a.id_),
+        lambda a: delete_task_async(a.user_id, a.id_),
+    ),
+    "search_career": Tool(
+        UserArgs,
+        lambda a: search_career(a.user_id),
+        lambda a: search_career_async(a.user_id),
+    ),
+    "add_career": Tool(
+        AddCareerArgs,
+        lambda a: add_career(a.user_id, a.career_title, a.career_description, a.target_period),
+        lambda a: add_career_async(a.user_id, a.career_title, a.career_description, a.target_period),
+    ),
+    "update_career": Tool(
+        UpdateCareerArgs,
+        lambda a: update_career(a.user_id, a.id_, a.career_title, a.career_description, a.target_period),
+        lambda a: update_career_async(a.user_id, a.id_, a.career_title, a.career_description, a.target_period),
+    ),
+    "delete_career": Tool(
+        TargetArgs,
+        lambda a: delete_career(a.user_id, a.id_),
+        lambda a: delete_career_async(a.user_id, a.id_),
+    ),
+    "search_initiatives": Tool(
+        UserArgs,
+        lambda a: search_initiatives(a.user_id),
+        lambda a: search_initiatives_async(a.user_id),
+    ),
+    "add_initiative": Tool(
+        AddInitiativeArgs,
+        lambda a: add_initiative(a.user_id, a.title, a.body, a.target_period),
+        lambda a: add_initiative_async(a.user_id, a.title, a.body, a.target_period),
+    ),
+    "update_initiative": Tool(
+        UpdateInitiativeArgs,
+        lambda a: update_initiative(a.user_id, a.id_, a.title, a.body, a.target_period),
+        lambda a: update_initiative_async(a.user_id, a.id_, a.title, a.body, a.target_period),
+    ),
+    "delete_initiative": Tool(
+        TargetArgs,
+        lambda a: delete_initiative(a.user_id, a.id_),
+        lambda a: delete_initiative_async(a.user_id, a.id_),
+    ),
+}
@@ -0,0 +1,83 @@
+from typing import Annotated
+
+from pydantic import BaseModel, BeforeValidator, Field
+
+# tasks.estimated_time は VARCHAR ("30分" など)。数値で渡された場合も文字列にする
+EstimatedTime = Annotated[str, BeforeValidator(str)]
+
+
+class DataRequest(BaseModel):
+    function_name: str
+    args: dict
+
+
+class DataResponse(BaseModel):
+    status: str
+    message: str
+    data: str | None = None
+
+
+class BatchDataRequest(BaseModel):
+    requests: list[DataRequest]
+
+
+class BatchDataResponse(BaseModel):
+    results: list[DataResponse]
+
+
+class UserArgs(BaseModel):
+    user_id: str
+
+
+class TargetArgs(UserArgs):
+    id_: str = Field(alias="id")
+
+
+class AddMemoryArgs(UserArgs):
+    content: str
+    category: str
+
+
+class UpdateMemoryArgs(TargetArgs):
+    content: str
+
+
+class AddTaskArgs(UserArgs):
+    title: str
+    description: str
+    recommend: str
+    category: str
+    estimated_time: EstimatedTime
+
+
+class UpdateTaskArgs(TargetArgs):
+    title: str
+    description: str
+    recommend: str
+    category: str
+    estimated_time: EstimatedTime
+    completed: bool
+
+
+class AddCareerArgs(UserArgs):
+    career_title: str
+    career_description: str
+    target_period: str
+
+
+class UpdateCareerArgs(TargetArgs):
+    career_title: str
+    career_description: str
+    target_period: str
+
+
+class AddInitiativeArgs(UserArgs):
+    title: str
+    body: str
+    target_period: str
+
+
+class UpdateInitiativeArgs(TargetArgs):
+    title: str
+    body: str
+    target_period: str
@@ -0,0 +1,24 @@
+-- ユーザーごとに作成日時の新しい順で取得するクエリ用のインデックス
+-- 本番のテーブルをロックしないように CONCURRENTLY で作成する (トランザクション外で実行する)
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS memory_user_id_created_at_idx
+    ON memory (user_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS information_user_id_created_at_idx
+    ON information (user_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_user_id_created_at_idx
+    ON tasks (user_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS manuscripts_user_id_created_at_idx
+    ON manuscripts (user_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS routines_user_id_created_at_idx
+    ON routines (user_id, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS career_goals_user_id_created_at_idx
+    ON career_goals (user_id, created_at DESC);
+
+-- 削除されていないものだけを取得するクエリ用の部分インデックス
+CREATE INDEX CONCURRENTLY IF NOT EXISTS initiatives_user_id_active_idx
+    ON initiatives (user_id) WHERE deleted = false;
@@ -0,0 +1,19 @@
+-- 同じユーザーに同じURLの情報を重複して保存しないように、(user_id, url) を一意にする
+-- 適用中は information に書き込むジョブ (tasks の crawl-events など) を Cloud Scheduler で一時停止しておくこと
+-- (重複を消してからインデックスを作成し終えるまでに同じURLが保存されると、インデックスの作成に失敗する)
+-- 失敗した場合はジョブを止めたまま再実行する (前回の作成失敗で残った INVALID なインデックスは最初に削除する)
+
+DROP INDEX CONCURRENTLY IF EXISTS information_user_id_url_key;
+
+-- 既存の重複を消す (お気に入りに登録されているもの、次に古いものを残す)
+DELETE FROM information
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id, url ORDER BY favorite DESC, id) AS rn
+        FROM information
+    ) ranked
+    WHERE rn > 1
+);
+
+CREATE UNIQUE INDEX CONCURRENTLY information_user_id_url_key
+    ON information (user_id, url);
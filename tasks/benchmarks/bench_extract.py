@@ -0,0 +1,88 @@
+"""
+Webページの本文抽出のベンチマーク
+
+保存しておいたHTML (fixtures/*.html) から本文を取り出し、
+以前の BeautifulSoup (html.parser) + get_text() と、common/extract.py の lxml による抽出を比較する。
+1秒あたりに処理できるページ数と、Geminiに渡すプロンプトに含まれる本文のバイト数を出力する。
+
+使い方:
+    uv run python benchmarks/bench_extract.py
+    uv run python benchmarks/bench_extract.py --fixtures-dir path/to/html --repeat 200
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from collections.abc import Callable
+
+from bs4 import BeautifulSoup
+
+TASKS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TASKS_DIR)
+
+from common.extract import EXTRACT_MAX_CHARS, extract_text  # noqa: E402
+
+
+def _extract_text_bs4(html: bytes, encoding: str | None) -> str:
+    """以前の抽出方法 (ページ全体のテキストを取り出す)"""
+    soup = BeautifulSoup(html, "html.parser", from_encoding=encoding)
+    text = soup.get_text()
+    text = re.sub(r"\n+", "\n", text)
+    return text
+
+
+def _load_fixtures(fixtures_dir: str) -> list[tuple[str, bytes]]:
+    paths = sorted(glob.glob(os.path.join(fixtures_dir, "*.html")))
+    fixtures = []
+    for path in paths:
+        with open(path, "rb") as f:
+            fixtures.append((os.path.basename(path), f.read()))
+    return fixtures
+
+
+def run(extractor: Callable[[bytes, str | None], str], fixtures: list[tuple[str, bytes]], repeat: int) -> dict:
+    """すべてのページを repeat 回抽出し、スループットとプロンプトに含まれるバイト数を集計する"""
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for _, html in fixtures:
+            extractor(html, None)
+    elapsed = time.perf_counter() - start_time
+
+    # _generate_recommend_results と同じく EXTRACT_MAX_CHARS 文字で切り詰めたものがGeminiに送られる
+    prompt_bytes = {name: len(extractor(html, None)[:EXTRACT_MAX_CHARS].encode("utf-8")) for name, html in fixtures}
+    return {
+        "pages_per_second": len(fixtures) * repeat / elapsed,
+        "prompt_bytes": prompt_bytes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark HTML-to-text extraction")
+    parser.add_argument("--fixtures-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+    parser.add_argument("--repeat", type=int, default=100, help="times to extract each page")
+    args = parser.parse_args()
+
+    fixtures = _load_fixtures(args.fixtures_dir)
+    if not fixtures:
+        raise SystemExit(f"no html files in {args.fixtures_dir}")
+
+    extractors: dict[str, Callable[[bytes, str | None], str]] = {"bs4": _extract_text_bs4, "lxml": extract_text}
+    results = {name: run(extractor, fixtures, args.repeat) for name, extractor in extractors.items()}
+
+    print(f"{'extractor':>9} {'pages/s':>9} {'prompt bytes':>12}")
+    for name, result in results.items():
+        total_bytes = sum(result["prompt_bytes"].values())
+        print(f"{name:>9} {result['pages_per_second']:>9.1f} {total_bytes:>12}")
+
+    print()
+    print(f"{'fixture':<24} {'html bytes':>10} " + " ".join(f"{name:>12}" for name in results))
+    for name, html in fixtures:
+        sizes = " ".join(f"{result['prompt_bytes'][name]:>12}" for result in results.values())
+        print(f"{name:<24} {len(html):>10} {sizes}")
+
+
+if __name__ == "__main__":
+    main()
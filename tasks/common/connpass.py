@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from common.memo import TtlMemo
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CONNPASS_API_URL = "https://connpass.com/api/v2/events/"
+CONNPASS_TIMEOUT = float(os.getenv("CONNPASS_TIMEOUT", "10"))
+# Connpass APIへのリクエスト数の上限 (1秒あたり。プロセス全体で共有する)
+CONNPASS_REQUESTS_PER_SECOND = float(os.getenv("CONNPASS_REQUESTS_PER_SECOND", "1"))
+CONNPASS_MAX_WORKERS = int(os.getenv("CONNPASS_MAX_WORKERS", "4"))
+# 1回のリクエストで取得するイベント数 (最大100) と、1キーワードあたりに取得するページ数
+CONNPASS_PAGE_SIZE = int(os.getenv("CONNPASS_PAGE_SIZE", "10"))
+CONNPASS_MAX_PAGES = int(os.getenv("CONNPASS_MAX_PAGES", "1"))
+# 1ユーザーあたりにレコメンドの候補にするイベント数と、イベントの説明文の上限文字数
+CONNPASS_MAX_EVENTS = int(os.getenv("CONNPASS_MAX_EVENTS", "10"))
+CONNPASS_DESCRIPTION_MAX_CHARS = int(os.getenv("CONNPASS_DESCRIPTION_MAX_CHARS", "2000"))
+# 同じキーワードの検索結果を使い回す秒数 (0で無効)
+CONNPASS_CACHE_TTL = float(os.getenv("CONNPASS_CACHE_TTL", "21600"))
+
+
+class RateLimiter:
+    """リクエストの間隔が 1 / rate 秒以上になるように待つ (スレッドセーフ)"""
+
+    def __init__(self, rate: float) -> None:
+        self._interval = 1 / rate if rate > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self._interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+_rate_limiter = RateLimiter(CONNPASS_REQUESTS_PER_SECOND)
+_events_memo: TtlMemo[list[dict[str, Any]]] = TtlMemo(CONNPASS_CACHE_TTL)
+
+
+def _get_session() -> requests.Session:
+    """Connpass APIへの接続を使い回すためのセッションを返す"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONNPASS_MAX_WORKERS)
+                session.mount("https://", adapter)
+                session.headers.update({"X-API-Key": os.getenv("CONNPASS_API_KEY") or "", "User-Agent": "Mozilla/5.0"})
+                _session = session
+    return _session
+
+
+def _fetch_events(keyword: str) -> list[dict[str, Any]]:
+    """キーワードでイベントを検索し、CONNPASS_MAX_PAGES ページまで取得する"""
+    events: list[dict[str, Any]] = []
+    for page in range(CONNPASS_MAX_PAGES):
+        params = {"keyword": keyword, "count": CONNPASS_PAGE_SIZE, "start": page * CONNPASS_PAGE_SIZE + 1}
+        _rate_limiter.wait()
+        response = _get_session().get(CONNPASS_API_URL, params=params, timeout=CONNPASS_TIMEOUT)
+        response.raise_for_status()
+        body = response.json()
+        page_events = body.get("events", [])
+        events.extend(page_events)
+        if len(events) >= body.get("results_available", 0) or len(page_events) < CONNPASS_PAGE_SIZE:
+            break
+    return events
+
+
+def search_events(keyword: str) -> list[dict[str, Any]]:
+    """
+    キーワードでConnpassのイベントを検索する
+    - 同じキーワードはTTLの間は結果を使い回し、他のユーザーの処理で実行中なら結果を待つ
+    - 失敗した場合は空のリストを返す (結果はキャッシュしない)
+    """
+    try:
+        return _events_memo.get_or_compute(keyword, lambda: _fetch_events(keyword))
+    except Exception as e:
+        logger.error(f"Failed to search connpass ({keyword}): {e}")
+        return []
+
+
+def search_events_many(keywords: list[str]) -> list[list[dict[str, Any]]]:
+    """
+    複数のキーワードで並行して検索し、キーワードの順番どおりに結果を返す
+    """
+    unique_keywords = list(dict.fromkeys(keywords))
+    if not unique_keywords:
+        return []
+    with ThreadPoolExecutor(max_workers=min(CONNPASS_MAX_WORKERS, len(unique_keywords))) as executor:
+        results = dict(zip(unique_keywords, executor.map(search_events, unique_keywords), strict=True))
+    return [results[keyword] for keyword in keywords]
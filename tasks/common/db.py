@@ -1,11 +1,14 @@
+import atexit
 import logging
 import os
 import sys
+import threading
 from datetime import datetime
 from typing import Any
 
 import sqlalchemy
 from dotenv import load_dotenv
+from sqlalchemy.dialects import postgresql
 from google.cloud.sql.connector import Connector, IPTypes
 from sqlalchemy.engine.base import Connection
 
@@ -27,71 +30,184 @@ DB_NAME = os.environ.get("DB_NAME")
 
 # cf. https://cloud.google.com/blog/ja/topics/developers-practitioners/how-connect-cloud-sql-using-python-easy-way?hl=ja
 
+# コネクションプールの設定
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+# 1つのSQLの実行時間の上限 (秒)。応答しないクエリが全ユーザー実行のワーカーを使い続けないようにする (0で無効)
+DB_STATEMENT_TIMEOUT = float(os.environ.get("DB_STATEMENT_TIMEOUT", "60"))
+
+# 1つのINSERT文にまとめる最大行数 (PostgreSQLのバインドパラメータ上限65535を超えないようにする)
+BULK_INSERT_CHUNK_SIZE = 500
+
+# information の (user_id, url) の一意インデックス (migrations/0002) が使えることを確認できたか
+_information_unique_index_ready = False
+
+# インスタンス内の呼び出しで共有するConnectorとEngine
+_connector: Connector | None = None
+_engine: sqlalchemy.engine.base.Engine | None = None
+_engine_lock = threading.Lock()
+
+
+def _getconn() -> Connection:
+    assert _connector is not None
+    conn = _connector.connect(
+        INSTANCE_CONNECTION_NAME,
+        "pg8000",
+        user=DB_USER,
+        password=DB_PASSWORD,
+        db=DB_NAME,
+        ip_type=IPTypes.PUBLIC,
+        tcp_keepalive=True,
+    )
+    if DB_STATEMENT_TIMEOUT > 0:
+        cursor = conn.cursor()
+        cursor.execute(f"SET statement_timeout = {int(DB_STATEMENT_TIMEOUT * 1000)}")
+        cursor.close()
+        conn.commit()
+    return conn
+
 
 def connect_tcp_socket() -> sqlalchemy.engine.base.Engine:
     """
-    Cloud SQLの接続を確立する関数
+    Cloud SQLのコネクションプールを取得する関数
+    - Cloud Functionsのインスタンスが生きている間はEngineを使い回す
     """
-
-    def _getconn() -> Connection:
-        with Connector() as connector:
-            conn = connector.connect(
-                INSTANCE_CONNECTION_NAME, "pg8000", user=DB_USER, password=DB_PASSWORD, db=DB_NAME, ip_type=IPTypes.PUBLIC
+    global _connector, _engine
+    if _engine is not None:
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            _connector = Connector()
+            _engine = sqlalchemy.create_engine(
+                "postgresql+pg8000://",
+                creator=_getconn,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+                pool_recycle=DB_POOL_RECYCLE,
+                pool_pre_ping=True,
             )
-        return conn
+    return _engine
 
-    pool = sqlalchemy.create_engine(
-        "postgresql+pg8000://",
-        creator=_getconn,
-    )
-    return pool
+
+def dispose_engine() -> None:
+    """
+    インスタンス終了時にコネクションプールとConnectorを破棄する
+    """
+    global _connector, _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+        if _connector is not None:
+            _connector.close()
+            _connector = None
+
+
+atexit.register(dispose_engine)
 
 
 def execute_sql_with_params(sql: str, params: dict | list[dict]) -> tuple[list[Any], bool]:
     """
     SQLを実行する関数
+    - paramsがリストの場合は1トランザクション内でexecutemanyとして実行する
     """
     pool = connect_tcp_socket()
     results = []
     try:
-        if sql.strip().upper().startswith('SELECT'):
-            with pool.connect() as conn:
+        with pool.connect() as conn:
+            if sql.strip().upper().startswith('SELECT'):
                 result = conn.execute(sqlalchemy.text(sql), parameters=params)
                 results = result.fetchall()
-        else:
-            if isinstance(params, list):
-                with pool.connect() as conn:
-                    for param in params:
-                        conn.execute(sqlalchemy.text(sql), parameters=param)
-                    conn.commit()
             else:
-                with pool.connect() as conn:
-                    conn.execute(sqlalchemy.text(sql), parameters=params)
-                    conn.commit()
+                if not params:
+                    return [], True
+                conn.execute(sqlalchemy.text(sql), parameters=params)
+                conn.commit()
     except Exception as e:
         logger.error(f"Error executing SQL: {e}")
         return [], False
-    finally:
-        pool.dispose()
     return list(results), True
 
 
-def fetch_information_urls(user_id: str) -> list[str]:
+def execute_bulk_insert(table_name: str, rows: list[dict], conflict_columns: list[str] | None = None) -> bool:
+    """
+    複数行を multi-row VALUES のINSERT文にまとめて1トランザクションで保存する
+    - conflict_columns を指定した場合は、一意制約に反する行は保存せずにスキップする (ON CONFLICT DO NOTHING)
+    """
+    if not rows:
+        return True
+    columns = list(rows[0].keys())
+    table = sqlalchemy.table(table_name, *[sqlalchemy.column(column) for column in columns])
     pool = connect_tcp_socket()
     try:
-        with pool.connect() as conn:
-            results = conn.execute(
-                sqlalchemy.text("SELECT url FROM information WHERE user_id = :user_id"),
-                {"user_id": user_id},
-            ).fetchall()
+        with pool.begin() as conn:
+            for i in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+                statement = postgresql.insert(table).values(rows[i : i + BULK_INSERT_CHUNK_SIZE])
+                if conflict_columns:
+                    statement = statement.on_conflict_do_nothing(index_elements=conflict_columns)
+                conn.execute(statement)
     except Exception as e:
-        logger.error(f"Error fetching information urls: {e}")
+        logger.error(f"Error executing bulk insert into {table_name}: {e}")
+        return False
+    return True
+
+
+def _has_information_unique_index() -> bool:
+    """
+    information の (user_id, url) の一意インデックスが使えるかどうかを返す
+    - migrations/0002 の適用前や、作成中・作成に失敗して INVALID のときは使えない
+    - 使えることを確認できたら、以降は確認しない
+    """
+    global _information_unique_index_ready
+    if _information_unique_index_ready:
+        return True
+    sql = """
+    SELECT 1 FROM pg_index
+    JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+    WHERE pg_class.relname = 'information_user_id_url_key' AND pg_index.indisvalid AND pg_index.indisready
+    """
+    results, success = execute_sql_with_params(sql, {})
+    if success and results:
+        _information_unique_index_ready = True
+    else:
+        logger.warning("information_user_id_url_key is not ready, saving information without ON CONFLICT")
+    return _information_unique_index_ready
+
+
+def fetch_recent_information_urls(user_id: str, limit: int) -> list[str]:
+    """
+    ユーザーに最近保存した情報のURLを新しい順に最大limit件取得する
+    """
+    results, success = execute_sql_with_params(
+        "SELECT url FROM information WHERE user_id = :user_id ORDER BY created_at DESC LIMIT :limit",
+        {"user_id": user_id, "limit": limit},
+    )
+    if not success:
+        logger.error("Error fetching information urls")
         return []
-    finally:
-        pool.dispose()
     return [result[0] for result in results]
 
 
+def fetch_existing_information_urls(user_id: str, urls: list[str]) -> set[str] | None:
+    """
+    指定したURLのうち、すでにユーザーに保存されているものを取得する ((user_id, url) のインデックスを使う)
+    - 取得に失敗した場合はNoneを返す
+    """
+    if not urls:
+        return set()
+    results, success = execute_sql_with_params(
+        "SELECT url FROM information WHERE user_id = :user_id AND url = ANY(:urls)",
+        {"user_id": user_id, "urls": urls},
+    )
+    if not success:
+        logger.error("Error checking information urls")
+        return None
+    return {result[0] for result in results}
+
+
 def clean_text(text: str) -> str:
     """
     テキストからUTF-8として無効な文字 (NULLバイトを含む不正なUTF-8文字)を除去する
@@ -109,11 +225,9 @@ def save_event_to_information(events: list[Event]) -> str:
         event_dict["body"] = clean_text(event_dict["body"])
         events_dump.append(event_dict)
 
-    sql = """
-    INSERT INTO information (id, user_id, url, category, title, body, recommend_level, recommend_sentence, favorite, created_at)
-    VALUES (:id, :user_id, :url, :category, :title, :body, :recommend_level, :recommend_sentence, :favorite, :created_at)
-    """
-    _, success = execute_sql_with_params(sql, events_dump)
+    # 一意インデックスの作成前は ON CONFLICT (user_id, url) が使えないため、以前と同じく重複を確認せずに保存する
+    conflict_columns = ["user_id", "url"] if _has_information_unique_index() else None
+    success = execute_bulk_insert("information", events_dump, conflict_columns=conflict_columns)
     if not success:
         return "Error: データの保存に失敗しました。"
     logger.info(f"Event saved to information: {events}")
@@ -158,31 +272,7 @@ def save_quests_to_information(quests: list[Quest]) -> str:
     logger.info(f"Saving quests to information: {quests}")
     quests_dump = [quest.model_dump() for quest in quests]
 
-    sql = """
-    INSERT INTO tasks (
-        id,
-        user_id,
-        category,
-        title,
-        description,
-        recommend,
-        estimated_time,
-        completed,
-        created_at
-    )
-    VALUES (
-        :id,
-        :user_id,
-        :category,
-        :title,
-        :description,
-        :recommend,
-        :estimated_time,
-        :completed,
-        :created_at
-    )
-    """
-    _, success = execute_sql_with_params(sql, quests_dump)
+    success = execute_bulk_insert("tasks", quests_dump)
     if not success:
         return "Error: データの保存に失敗しました。"
     logger.info(f"Quests saved to information: {quests}")
@@ -233,8 +323,7 @@ def fetch_top3_today_information(user_id: str) -> list[dict]:
     SELECT id, title, body, url, recommend_level, category, created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Tokyo' AS created_at
     FROM information
     WHERE (
-        (created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Tokyo')::date
-        >= CURRENT_DATE - INTERVAL '1 days'
+        created_at >= ((CURRENT_DATE - 1)::timestamp AT TIME ZONE 'Asia/Tokyo') AT TIME ZONE 'UTC'
     ) AND user_id = :user_id
     ORDER BY recommend_level DESC
     LIMIT 3
@@ -266,8 +355,7 @@ def fetch_today_tasks(user_id: str) -> list[dict]:
     SELECT id, title, description, recommend, estimated_time, completed, created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Tokyo' AS created_at
     FROM tasks
     WHERE (
-        (created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Tokyo')::date
-        >= CURRENT_DATE - INTERVAL '1 days'
+        created_at >= ((CURRENT_DATE - 1)::timestamp AT TIME ZONE 'Asia/Tokyo') AT TIME ZONE 'UTC'
     ) AND user_id = :user_id
     ORDER BY created_at DESC
     """
@@ -377,27 +465,7 @@ def save_initiatives_to_db(initiatives: list[Initiative]) -> str:
     logger.info(f"Saving initiatives to db: {initiatives}")
     initiatives_dump = [initiative.model_dump() for initiative in initiatives]
 
-    sql = """
-    INSERT INTO initiatives (
-        id,
-        user_id,
-        title,
-        body,
-        target_period,
-        created_at,
-        deleted
-    )
-    VALUES (
-        :id,
-        :user_id,
-        :title,
-        :body,
-        :target_period,
-        :created_at,
-        :deleted
-    )
-    """
-    _, success = execute_sql_with_params(sql, initiatives_dump)
+    success = execute_bulk_insert("initiatives", initiatives_dump)
     if not success:
         return "Error: データの保存に失敗しました。"
     logger.info(f"Initiatives saved to db: {initiatives}")
@@ -421,13 +489,8 @@ def fetch_initiatives_from_db(user_id: str) -> str:
 
 
 def save_memory_to_db(memories: list[Memory]) -> str:
-    pool = connect_tcp_socket()
     memories_dump = [memory.model_dump() for memory in memories]
-    sql = """
-    INSERT INTO memory (id, user_id, category, content, created_at, updated_at)
-    VALUES (:id, :user_id, :category, :content, :created_at, :updated_at)
-    """
-    _, success = execute_sql_with_params(sql, memories_dump)
+    success = execute_bulk_insert("memory", memories_dump)
     if not success:
         return "Error: データの保存に失敗しました。"
     logger.info(f"Memories saved: {memories}")
@@ -477,8 +540,8 @@ def fetch_yesterdays_routines_from_db(user_id: str) -> list[Routine]:
     sql = """
     SELECT * FROM routines
     WHERE user_id = :user_id
-    AND (created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Tokyo')::date >= CURRENT_DATE - INTERVAL '1 day'
-    AND (created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Tokyo')::date < CURRENT_DATE
+    AND created_at >= ((CURRENT_DATE - 1)::timestamp AT TIME ZONE 'Asia/Tokyo') AT TIME ZONE 'UTC'
+    AND created_at < (CURRENT_DATE::timestamp AT TIME ZONE 'Asia/Tokyo') AT TIME ZONE 'UTC'
     """
     results, success = execute_sql_with_params(sql, {"user_id": user_id})
     if not success:
@@ -489,29 +552,7 @@ def fetch_yesterdays_routines_from_db(user_id: str) -> list[Routine]:
 def save_routines_to_db(routines: list[Routine]) -> str:
     logger.info(f"Saving routines to db: {routines}")
     routines_dump = [routine.model_dump() for routine in routines]
-    sql = """
-    INSERT INTO routines (
-        id,
-        user_id,
-        title,
-        description,
-        frequency,
-        time,
-        streak,
-        category,
-        completed,
-        created_at,
-        deleted
-    )
-    VALUES (
-        :id,
-        :user_id,
-        :title,
-        :description,
-        :frequency, :time, :streak, :category, :completed, :created_at, :deleted)
-    )
-    """
-    _, success = execute_sql_with_params(sql, routines_dump)
+    success = execute_bulk_insert("routines", routines_dump)
     if not success:
         return "Error: データの保存に失敗しました。"
     logger.info(f"Routines saved to db: {routines}")
@@ -0,0 +1,130 @@
+# agents/proxima/extract.py と同じ内容
+# tasks と agents は別々にデプロイするため、それぞれに置いている。変更するときは両方を更新する
+import os
+import re
+
+import lxml.html
+from lxml import etree
+
+# プロンプトに含める本文の上限 (文字数)
+EXTRACT_MAX_CHARS = int(os.getenv("EXTRACT_MAX_CHARS", "10000"))
+# 本文ではない要素 (中身ごと削除する)
+NON_CONTENT_TAGS = (
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "iframe",
+)
+# 本文の周りのナビゲーションなど (削除すると本文が残らないページでは削除しない)
+BOILERPLATE_TAGS = (
+    "nav",
+    "footer",
+    "aside",
+)
+# 前後で改行する要素
+BLOCK_TAGS = (
+    "p",
+    "div",
+    "section",
+    "article",
+    "main",
+    "li",
+    "dt",
+    "dd",
+    "tr",
+    "th",
+    "td",
+    "br",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "pre",
+    "blockquote",
+    "table",
+)
+# 本文がある要素の候補 (上から順に探す)
+MAIN_CONTENT_XPATHS = ("//main", "//article", "//*[@role='main']")
+# 本文の候補として採用する最小の文字数
+MIN_MAIN_CONTENT_CHARS = 200
+
+_CHARSET_PATTERN = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+_META_CHARSET_PATTERN = re.compile(rb"<meta[^>]+charset", re.IGNORECASE)
+_SPACES_PATTERN = re.compile(r"[ \t\r\f\v　]+")
+
+
+def charset_from_content_type(content_type: str | None) -> str | None:
+    """Content-Typeヘッダーで指定された文字コードを返す"""
+    if not content_type:
+        return None
+    match = _CHARSET_PATTERN.search(content_type)
+    return match.group(1) if match else None
+
+
+def _parse(html: bytes, encoding: str | None) -> lxml.html.HtmlElement:
+    """
+    HTMLをパースする
+    - 文字コードはヘッダーの指定を優先し、なければ<meta charset>からlxmlに判定させる
+    - どちらもなければ UTF-8 として読めるか試す (lxmlのデフォルトの Latin-1 では日本語が文字化けする)
+    """
+    if not encoding and not _META_CHARSET_PATTERN.search(html[:4096]):
+        try:
+            html.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            pass
+    if encoding:
+        try:
+            return lxml.html.document_fromstring(html, parser=lxml.html.HTMLParser(encoding=encoding, remove_comments=True))
+        except (LookupError, etree.ParserError, ValueError):
+            pass
+    return lxml.html.document_fromstring(html, parser=lxml.html.HTMLParser(remove_comments=True))
+
+
+def _normalize(text: str) -> str:
+    lines = (_SPACES_PATTERN.sub(" ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _load(html: bytes, encoding: str | None, drop_boilerplate: bool) -> lxml.html.HtmlElement:
+    """パースして本文ではない要素を削除し、ブロック要素の区切りに改行を入れる"""
+    document = _parse(html, encoding)
+    tags = NON_CONTENT_TAGS + BOILERPLATE_TAGS if drop_boilerplate else NON_CONTENT_TAGS
+    etree.strip_elements(document, *tags, with_tail=False)
+    for element in document.iter(*BLOCK_TAGS):
+        element.tail = "\n" + element.tail if element.tail else "\n"
+    return document
+
+
+def _content_text(document: lxml.html.HtmlElement) -> str:
+    """<main>や<article>に十分な本文があればその中だけを、なければ<body>全体のテキストを返す"""
+    for xpath in MAIN_CONTENT_XPATHS:
+        candidates = document.xpath(xpath)
+        if candidates:
+            main_text = _normalize("\n".join(candidate.text_content() for candidate in candidates))
+            if len(main_text) >= MIN_MAIN_CONTENT_CHARS:
+                return main_text
+    body = document.find("body")
+    return _normalize((body if body is not None else document).text_content())
+
+
+def extract_text(html: bytes, encoding: str | None = None, max_chars: int = EXTRACT_MAX_CHARS) -> str:
+    """
+    Webページから本文のテキストを取り出す
+    - script/style やナビゲーション・フッターなどを除き、<main>や<article>があればその中だけを使う
+    - ナビゲーションなどを除くと何も残らないページは、それらを含めて取り出す
+    - max_chars 文字で切り詰める
+    """
+    if not html or not html.strip():
+        return ""
+    try:
+        text = _content_text(_load(html, encoding, drop_boilerplate=True))
+        if not text:
+            text = _content_text(_load(html, encoding, drop_boilerplate=False))
+    except (etree.ParserError, ValueError):
+        return ""
+    return text[:max_chars]
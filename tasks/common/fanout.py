@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any
+
+from common.schemas import FanOutSummary
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+FANOUT_MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", "8"))
+FANOUT_USER_TIMEOUT = float(os.getenv("FANOUT_USER_TIMEOUT", "180"))
+# 全ユーザーの処理を待つ秒数 (関数のタイムアウト10分より短くして、サマリーを返せるようにする)
+FANOUT_RUN_TIMEOUT = float(os.getenv("FANOUT_RUN_TIMEOUT", "540"))
+
+
+def shard_of(user_id: str, shard_count: int) -> int:
+    """
+    user_idのハッシュからシャード番号を決める
+    - Pythonのhash()はプロセスごとにランダム化されるため、インスタンス間で一致するsha1を使う
+    """
+    digest = hashlib.sha1(user_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def select_shard(user_ids: list[str], shard_index: int, shard_count: int) -> list[str]:
+    """
+    全ユーザーのうち、shard_index番目のシャードに属するユーザーだけを返す
+    """
+    if shard_count < 1:
+        raise ValueError(f"shard_count must be >= 1: {shard_count}")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard_index must be in [0, {shard_count}): {shard_index}")
+    return [user_id for user_id in user_ids if shard_of(user_id, shard_count) == shard_index]
+
+
+def _is_failure(result: Any) -> bool:
+    """
+    各タスクの戻り値 ("メッセージ", ステータスコード) からエラーかどうかを判定する
+    """
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], int):
+        return result[1] >= 500
+    return False
+
+
+def run_for_users(
+    user_ids: list[str],
+    handler: Callable[[str], Any],
+    max_workers: int = FANOUT_MAX_WORKERS,
+    user_timeout: float = FANOUT_USER_TIMEOUT,
+    run_timeout: float = FANOUT_RUN_TIMEOUT,
+) -> FanOutSummary:
+    """
+    ユーザーごとの処理をスレッドプールで並列に実行する
+    - 同時実行数はmax_workersで制限する
+    - 1ユーザーの処理がuser_timeout秒を超えた場合はタイムアウトとして扱い、結果を待たずに次へ進む
+      (スレッドは強制終了できないため、処理自体はバックグラウンドで走り続け、そのあいだワーカーを使い続ける。
+      ワーカーが空くように、各処理のHTTP/DBへのリクエストにはそれぞれタイムアウトを設定しておくこと)
+    - 全体でrun_timeout秒を超えた場合は、まだ終わっていないユーザー (開始待ちのユーザーを含む) をすべてタイムアウトとして扱う
+      (タイムアウトした処理がワーカーを使い切っても、実行全体は必ず終わる)
+    - 1ユーザーの例外は他のユーザーの処理に影響させない
+    """
+    start_time = time.time()
+    run_deadline = start_time + run_timeout
+    handler_name = getattr(handler, "__name__", str(handler))
+    logger.info(f"Fan-out {handler_name} for {len(user_ids)} users (max_workers={max_workers}, run_timeout={run_timeout})")
+
+    succeeded: list[str] = []
+    failed: list[str] = []
+    timed_out: list[str] = []
+    started_at: dict[str, float] = {}
+
+    def _run(user_id: str) -> Any:
+        started_at[user_id] = time.time()
+        return handler(user_id)
+
+    executor = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix=f"fanout-{handler_name}")
+    try:
+        pending: dict[Future, str] = {executor.submit(_run, user_id): user_id for user_id in user_ids}
+        while pending:
+            done, _ = wait(pending.keys(), timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                user_id = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Fan-out {handler_name} failed for user {user_id}: {e}")
+                    failed.append(user_id)
+                    continue
+                if _is_failure(result):
+                    logger.error(f"Fan-out {handler_name} returned error for user {user_id}: {result}")
+                    failed.append(user_id)
+                else:
+                    succeeded.append(user_id)
+
+            now = time.time()
+            if now > run_deadline and pending:
+                not_started = sum(1 for user_id in pending.values() if user_id not in started_at)
+                logger.error(
+                    f"Fan-out {handler_name} exceeded {run_timeout} seconds: "
+                    f"{len(pending)} users timed out ({not_started} not started)"
+                )
+                for future, user_id in pending.items():
+                    future.cancel()
+                    timed_out.append(user_id)
+                pending.clear()
+                break
+            for future, user_id in list(pending.items()):
+                user_started_at = started_at.get(user_id)
+                if user_started_at is not None and now - user_started_at > user_timeout:
+                    logger.error(f"Fan-out {handler_name} timed out for user {user_id} after {user_timeout} seconds")
+                    future.cancel()
+                    pending.pop(future)
+                    timed_out.append(user_id)
+    finally:
+        # タイムアウトしたスレッドの完了は待たない (開始待ちのものは取り消す)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    summary = FanOutSummary(
+        total=len(user_ids),
+        succeeded=len(succeeded),
+        failed=len(failed),
+        timed_out=len(timed_out),
+        failed_user_ids=failed,
+        timed_out_user_ids=timed_out,
+        elapsed_seconds=time.time() - start_time,
+    )
+    logger.info(f"Fan-out {handler_name} finished: {summary.model_dump()}")
+    return summary
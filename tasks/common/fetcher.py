@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+import httpx
+
+from common.extract import EXTRACT_MAX_CHARS, extract_text
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Webページ取得の設定
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "5"))
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "10"))
+# 1ページのダウンロードにかける時間の上限 (秒)
+FETCH_TOTAL_TIMEOUT = float(os.getenv("FETCH_TOTAL_TIMEOUT", "20"))
+# 1ページのダウンロードの上限 (HTMLのバイト数)。本文が EXTRACT_MAX_CHARS 文字に達していなくても、これを超えたら以降は読まない
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(4 * 1024 * 1024)))
+# 受信したバイト数がこの値・その2倍・4倍…に達するたびに本文を取り出し、EXTRACT_MAX_CHARS 文字に達していたら受信をやめる
+FETCH_TEXT_CHECK_BYTES = int(os.getenv("FETCH_TEXT_CHECK_BYTES", str(256 * 1024)))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "20"))
+# 同じホストへの同時リクエスト数の上限
+FETCH_MAX_PER_HOST = int(os.getenv("FETCH_MAX_PER_HOST", "2"))
+FETCH_USER_AGENT = "Mozilla/5.0 (compatible; ProximaBot/1.0)"
+
+
+@dataclass
+class FetchedPage:
+    """取得したWebページ (取得に失敗した場合は content が空になる)"""
+
+    content: bytes = b""
+    encoding: str | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    # 条件付きリクエストに 304 Not Modified が返ってきた
+    not_modified: bool = False
+
+
+class PageFetcher:
+    """
+    Webページを非同期にまとめて取得する
+    - 1つのコネクションプールを使い回し、ホストごとに同時リクエスト数を制限する
+    - ストリーミングで受信し、取り出した本文がプロンプトに含める文字数に達したら受信をやめる
+      (マークアップの多いページでも本文を取り出せるように、バイト数ではなく本文の文字数で判断する。
+      バイト数の上限は、本文がほとんどない巨大なページを読み続けないための安全策)
+    - クライアントとホストごとの制限は、同じイベントループ上の呼び出しすべてで共有する
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = FETCH_MAX_BYTES,
+        max_per_host: int = FETCH_MAX_PER_HOST,
+        max_connections: int = FETCH_MAX_CONNECTIONS,
+        text_check_bytes: int = FETCH_TEXT_CHECK_BYTES,
+    ) -> None:
+        self._max_bytes = max_bytes
+        self._text_check_bytes = text_check_bytes
+        self._max_per_host = max_per_host
+        self._max_connections = max_connections
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._client: httpx.AsyncClient | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            timeout = httpx.Timeout(FETCH_READ_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT)
+            limits = httpx.Limits(max_connections=self._max_connections, max_keepalive_connections=self._max_connections)
+            self._client = httpx.AsyncClient(
+                timeout=timeout, limits=limits, follow_redirects=True, headers={"User-Agent": FETCH_USER_AGENT}
+            )
+        return self._client
+
+    async def fetch_all(self, urls: list[str], validators: list[dict[str, str]] | None = None) -> list[FetchedPage]:
+        """
+        URLの順番どおりに取得したページを返す
+        - validators を指定すると、URLごとにそのヘッダー (If-None-Match など) を付けて条件付きリクエストを行う
+        """
+        validators = validators or [{} for _ in urls]
+        client = self._get_client()
+        return await asyncio.gather(
+            *[self._fetch(client, url, headers) for url, headers in zip(urls, validators, strict=True)]
+        )
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str, headers: dict[str, str]) -> FetchedPage:
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.setdefault(host, asyncio.Semaphore(self._max_per_host))
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(self._download(client, url, headers), timeout=FETCH_TOTAL_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"Failed to fetch {url}: {e!r}")
+                return FetchedPage()
+
+    async def _download(self, client: httpx.AsyncClient, url: str, headers: dict[str, str]) -> FetchedPage:
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == httpx.codes.NOT_MODIFIED:
+                return FetchedPage(
+                    etag=response.headers.get("etag"), last_modified=response.headers.get("last-modified"), not_modified=True
+                )
+            response.raise_for_status()
+            chunks = []
+            size = 0
+            next_check = self._text_check_bytes
+            async for chunk in response.aiter_bytes():
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= self._max_bytes:
+                    logger.info(f"Stopped reading {url} at {size} bytes (max bytes)")
+                    break
+                if next_check > 0 and size >= next_check:
+                    next_check *= 2
+                    # パースはイベントループを止めないように別スレッドで行う
+                    text = await asyncio.to_thread(extract_text, b"".join(chunks), response.charset_encoding)
+                    if len(text) >= EXTRACT_MAX_CHARS:
+                        logger.info(f"Stopped reading {url} at {size} bytes ({len(text)} chars of text)")
+                        break
+            return FetchedPage(
+                content=b"".join(chunks)[: self._max_bytes],
+                encoding=response.charset_encoding,
+                etag=response.headers.get("etag"),
+                last_modified=response.headers.get("last-modified"),
+            )
+
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+_fetcher = PageFetcher()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Webページの取得に使うイベントループを返す
+    - ユーザーごとのスレッドから呼ばれても同じクライアントとホストごとの制限を使うように、
+      プロセスで1つのループを専用のスレッドで動かす
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="page-fetcher", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def fetch_pages(urls: list[str], validators: list[dict[str, str]] | None = None) -> list[FetchedPage]:
+    """
+    複数のWebページを1度にまとめて取得する (同期関数から呼び出す)
+    """
+    if not urls:
+        return []
+    return asyncio.run_coroutine_threadsafe(_fetcher.fetch_all(urls, validators), _get_loop()).result()
@@ -0,0 +1,19 @@
+import os
+
+from dotenv import load_dotenv
+from google import genai
+from google.genai import types
+
+load_dotenv()
+
+# Geminiへのリクエストのタイムアウト (秒)
+# 全ユーザー実行で応答が返らないリクエストがワーカーを使い続けないようにする
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "120"))
+
+
+def create_client() -> genai.Client:
+    """タイムアウトを設定したGeminiのクライアントを作成する"""
+    return genai.Client(
+        api_key=os.getenv("GOOGLE_API_KEY"),
+        http_options=types.HttpOptions(timeout=int(GEMINI_TIMEOUT * 1000)),
+    )
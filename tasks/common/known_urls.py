@@ -0,0 +1,54 @@
+import logging
+import os
+from collections import OrderedDict
+from collections.abc import Iterable
+
+from common.db import fetch_existing_information_urls, fetch_recent_information_urls
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 最初に読み込んでおく最近のURLの件数
+KNOWN_URLS_MAX_RECENT = int(os.getenv("KNOWN_URLS_MAX_RECENT", "1000"))
+
+
+class KnownUrls:
+    """
+    ユーザーにすでに保存した情報のURLを調べる
+    - 最近のURLだけをメモリ上に持ち (上限あり)、それ以外は (user_id, url) のインデックスでまとめて確認する
+    - 全件を読み込まないため、informationテーブルが大きくなってもメモリと時間が増えない
+    """
+
+    def __init__(self, user_id: str, max_recent: int = KNOWN_URLS_MAX_RECENT) -> None:
+        self._user_id = user_id
+        self._max_recent = max_recent
+        self._recent: OrderedDict[str, None] = OrderedDict()
+        for url in reversed(fetch_recent_information_urls(user_id, max_recent)):
+            self._remember(url)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._recent
+
+    def add(self, url: str) -> None:
+        """保存する予定のURLを追加する"""
+        self._remember(url)
+
+    def filter_new(self, urls: Iterable[str]) -> list[str]:
+        """
+        まだ保存していないURLだけを順番を保って返す (重複は除く)
+        - メモリ上にないURLはDBでまとめて確認する
+        """
+        candidates = list(dict.fromkeys(url for url in urls if url not in self._recent))
+        existing = fetch_existing_information_urls(self._user_id, candidates)
+        if existing is None:
+            # 確認できなかった場合も、保存時の ON CONFLICT DO NOTHING で重複は防げる
+            existing = set()
+        for url in existing:
+            self._remember(url)
+        return [url for url in candidates if url not in existing]
+
+    def _remember(self, url: str) -> None:
+        self._recent[url] = None
+        self._recent.move_to_end(url)
+        while len(self._recent) > self._max_recent:
+            self._recent.popitem(last=False)
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Protocol
+
+from dotenv import load_dotenv
+
+from common.extract import extract_text
+from common.fetcher import FetchedPage, fetch_pages
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 取得したページをそのまま使う秒数 (過ぎたら ETag / Last-Modified で再検証する。0で無効)
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "21600"))
+# キャッシュの保存先: "disk" はインスタンスのローカルディスク、"gcs" はインスタンス間で共有するGCSバケット
+PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "disk")
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "/tmp/proxima-page-cache")
+# ディスクに保存する合計サイズの上限 (バイト)。超えたら最も使われていないものから捨てる
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PAGE_CACHE_GCS_BUCKET = os.getenv("PAGE_CACHE_GCS_BUCKET")
+PAGE_CACHE_GCS_PREFIX = os.getenv("PAGE_CACHE_GCS_PREFIX", "page-cache/")
+
+
+@dataclass
+class CachedPage:
+    """URLごとに保存する、Webページから取り出した本文"""
+
+    url: str
+    text: str
+    etag: str | None = None
+    last_modified: str | None = None
+    # 最後に取得・再検証した時刻 (UNIX時間)
+    fetched_at: float = 0.0
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.fetched_at < ttl
+
+    def validators(self) -> dict[str, str]:
+        """条件付きリクエストのヘッダー"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCacheBackend(Protocol):
+    def get(self, key: str) -> str | None: ...
+
+    def set(self, key: str, value: str) -> None: ...
+
+
+class DiskBackend:
+    """
+    ローカルディスクのキャッシュ
+    - 1ページを1つのJSONファイルに保存する
+    - 合計サイズが上限を超えたら、最も使われていないものから捨てる
+    """
+
+    def __init__(self, directory: str = PAGE_CACHE_DIR, max_bytes: int = PAGE_CACHE_MAX_BYTES) -> None:
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # 使われた順に並べたファイルとサイズ (前回の実行で残ったファイルは更新時刻順に読み込む)
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        entries = [entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(".json")]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self._sizes[entry.name] = entry.stat().st_size
+        self._total_bytes = sum(self._sizes.values())
+
+    def get(self, key: str) -> str | None:
+        name = f"{key}.json"
+        try:
+            with open(os.path.join(self._directory, name), encoding="utf-8") as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if name in self._sizes:
+                self._sizes.move_to_end(name)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        name = f"{key}.json"
+        path = os.path.join(self._directory, name)
+        data = value.encode("utf-8")
+        # 書き込み途中のファイルを読まないように、一時ファイルに書いてから置き換える
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._total_bytes += len(data) - self._sizes.pop(name, 0)
+            self._sizes[name] = len(data)
+            while self._total_bytes > self._max_bytes and len(self._sizes) > 1:
+                evicted, size = self._sizes.popitem(last=False)
+                self._total_bytes -= size
+                try:
+                    os.remove(os.path.join(self._directory, evicted))
+                except FileNotFoundError:
+                    pass
+
+
+class GcsBackend:
+    """
+    GCSバケットのキャッシュ (インスタンス間・実行間で共有する)
+    - サイズの上限はバケットのライフサイクルルール (一定日数で削除) で設定する
+    """
+
+    def __init__(self, bucket_name: str | None = PAGE_CACHE_GCS_BUCKET, prefix: str = PAGE_CACHE_GCS_PREFIX) -> None:
+        from google.cloud import storage  # type: ignore
+
+        if not bucket_name:
+            raise ValueError("PAGE_CACHE_GCS_BUCKET is not set")
+        self._bucket = storage.Client(project=os.getenv("PROJECT_ID")).bucket(bucket_name)
+        self._prefix = prefix
+
+    def get(self, key: str) -> str | None:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            return self._bucket.blob(f"{self._prefix}{key}.json").download_as_text()
+        except NotFound:
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        self._bucket.blob(f"{self._prefix}{key}.json").upload_from_string(value, content_type="application/json")
+
+
+class PageCache:
+    """
+    URLごとのWebページの本文のキャッシュ (ユーザーをまたいで共有する)
+    - TTL以内に取得したページはリクエストせずに使う
+    - TTLを過ぎたページは ETag / Last-Modified で条件付きリクエストを行い、304 なら保存してある本文を使う
+    - 再取得に失敗したときは、保存してある古い本文を使う
+    - キャッシュの読み書きに失敗しても取得できるように、例外は握りつぶす
+    """
+
+    def __init__(self, backend: PageCacheBackend | None, ttl: float = PAGE_CACHE_TTL) -> None:
+        self._backend = backend
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {"fresh": 0, "revalidated": 0, "fetched": 0, "failed": 0}
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def get(self, url: str) -> CachedPage | None:
+        if self._backend is None or self._ttl <= 0:
+            return None
+        try:
+            value = self._backend.get(self._key(url))
+        except Exception as e:
+            logger.warning(f"Failed to read page cache: {e}")
+            return None
+        if value is None:
+            return None
+        try:
+            page = CachedPage(**json.loads(value))
+        except (ValueError, TypeError) as e:
+            # 書き込み途中で壊れたものや、形式が古いものはキャッシュにないものとして扱う (次に取得したときに上書きされる)
+            logger.warning(f"Ignoring broken page cache entry for {url}: {e}")
+            return None
+        # ハッシュが衝突した場合は別のページなので使わない
+        return page if page.url == url else None
+
+    def set(self, page: CachedPage) -> None:
+        if self._backend is None or self._ttl <= 0:
+            return
+        try:
+            self._backend.set(self._key(page.url), json.dumps(asdict(page), ensure_ascii=False))
+        except Exception as e:
+            logger.warning(f"Failed to write page cache: {e}")
+
+    def fetch_texts(self, urls: list[str]) -> list[str]:
+        """
+        URLの順番どおりにWebページの本文を返す (取得できなかったページは空文字)
+        - キャッシュにないページと再検証が必要なページだけを1度にまとめて取得する
+        """
+        cached = [self.get(url) for url in urls]
+        texts = [page.text if page is not None and page.is_fresh(self._ttl) else "" for page in cached]
+        targets = [i for i, page in enumerate(cached) if page is None or not page.is_fresh(self._ttl)]
+        fetched_pages = fetch_pages(
+            [urls[i] for i in targets],
+            [cached_page.validators() if (cached_page := cached[i]) is not None else {} for i in targets],
+        )
+
+        counts = {"fresh": len(urls) - len(targets), "revalidated": 0, "fetched": 0, "failed": 0}
+        for i, fetched in zip(targets, fetched_pages, strict=True):
+            texts[i], result = self._update(urls[i], cached[i], fetched)
+            counts[result] += 1
+        with self._lock:
+            for name, count in counts.items():
+                self._stats[name] += count
+        logger.info(f"page cache: {counts}")
+        return texts
+
+    def _update(self, url: str, cached: CachedPage | None, fetched: FetchedPage) -> tuple[str, str]:
+        """取得結果をキャッシュに反映し、(本文, 結果の種類) を返す"""
+        if fetched.not_modified and cached is not None:
+            cached.etag = fetched.etag or cached.etag
+            cached.last_modified = fetched.last_modified or cached.last_modified
+            cached.fetched_at = time.time()
+            self.set(cached)
+            return cached.text, "revalidated"
+        if not fetched.content:
+            return (cached.text if cached is not None else ""), "failed"
+        page = CachedPage(
+            url=url,
+            text=extract_text(fetched.content, fetched.encoding),
+            etag=fetched.etag,
+            last_modified=fetched.last_modified,
+            fetched_at=time.time(),
+        )
+        self.set(page)
+        return page.text, "fetched"
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+def _create_backend() -> PageCacheBackend | None:
+    try:
+        if PAGE_CACHE_BACKEND == "gcs":
+            return GcsBackend()
+        return DiskBackend()
+    except Exception as e:
+        # キャッシュが使えなくてもページは取得できるようにする
+        logger.warning(f"Page cache is disabled: {e}")
+        return None
+
+
+page_cache = PageCache(_create_backend())
@@ -157,3 +157,15 @@ class Routine(BaseModel):
     completed: bool
     created_at: datetime
     deleted: bool
+
+
+class FanOutSummary(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    timed_out: int
+    failed_user_ids: list[str]
+    timed_out_user_ids: list[str]
+    elapsed_seconds: float
+    shard_index: int | None = None
+    shard_count: int | None = None
@@ -1,13 +1,14 @@
 import logging
 import os
-import re
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Any
 
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from googleapiclient.discovery import build
 
+from common.known_urls import KnownUrls
+from common.memo import TtlMemo
+from common.page_cache import page_cache
 from common.schemas import GoogleSearchResult
 
 load_dotenv()
@@ -18,48 +19,78 @@ logger = logging.getLogger(__name__)
 
 API_KEY = os.getenv("GOOGLE_PROGRAMMABLE_SEARCH_API_KEY")
 CSE_ID = os.getenv("GOOGLE_PROGRAMMABLE_SEARCH_CSE_ID")
+# 同じ検索クエリの結果を使い回す秒数 (0で無効) と、保持するクエリ数の上限
+GOOGLE_SEARCH_CACHE_TTL = float(os.getenv("GOOGLE_SEARCH_CACHE_TTL", "21600"))
+GOOGLE_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("GOOGLE_SEARCH_CACHE_MAX_ENTRIES", "4096"))
+GOOGLE_SEARCH_NUM_RESULTS = 2
 
+# googleapiclient のサービスはスレッドセーフではないため、スレッドごとに1度だけ作成する
+_thread_local = threading.local()
+_search_memo: TtlMemo[list[dict[str, Any]]] = TtlMemo(GOOGLE_SEARCH_CACHE_TTL, GOOGLE_SEARCH_CACHE_MAX_ENTRIES)
 
-def _scrape_page(url: str) -> str:
+
+def _get_search_service() -> Any:
+    service = getattr(_thread_local, "search_service", None)
+    if service is None:
+        service = build("customsearch", "v1", developerKey=API_KEY)
+        _thread_local.search_service = service
+    return service
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+def _search_items(query: str) -> list[dict[str, Any]]:
     """
-    Webページをスクレイピングする関数
+    Custom Search APIで検索し、検索結果を返す
+    - 同じクエリはTTLの間は結果を使い回し、他のユーザーの処理で実行中なら結果を待つ
     """
-    response = requests.get(url)
-    html = response.content
-    soup = BeautifulSoup(html, "html.parser")
-    text = soup.get_text()
-    text = re.sub(r"\n+", "\n", text)
-    return text
 
+    def _search() -> list[dict[str, Any]]:
+        service = _get_search_service()
+        res = service.cse().list(q=query, cx=CSE_ID, start=1, num=GOOGLE_SEARCH_NUM_RESULTS, lr="lang_ja").execute()
+        return res.get("items", [])
 
-def google_search(queries: list[str], exist_urls: list[str] | None = None) -> dict[str, GoogleSearchResult]:
+    return _search_memo.get_or_compute((_normalize_query(query), GOOGLE_SEARCH_NUM_RESULTS), _search)
+
+
+def google_search(queries: list[str], known_urls: KnownUrls | None = None) -> dict[str, GoogleSearchResult]:
     """
     Google検索を行う関数
 
     :param queries: 検索クエリ
+    :param known_urls: すでに保存したURL (指定した場合は除外し、取得したURLを追加する)
     :return: 検索結果
     """
     logger.info(f"google_search: {queries}")
-    service = build("customsearch", "v1", developerKey=API_KEY)
+    # すべてのクエリの検索結果を集めてから、ページをまとめて取得する
+    items = []
+    for query in dict.fromkeys(map(_normalize_query, queries)):
+        items.extend(_search_items(query))
+
+    links = [item["link"] for item in items]
+    new_links = set(known_urls.filter_new(links)) if known_urls is not None else set(links)
+    urls = []
+    titles = []
+    for item in items:
+        if item["link"] not in new_links:
+            continue
+        new_links.discard(item["link"])
+        urls.append(item["link"])
+        titles.append(item["title"])
+        if known_urls is not None:
+            known_urls.add(item["link"])
+
+    # 他のユーザーの実行で取得したページはキャッシュから使う
+    texts = page_cache.fetch_texts(urls)
     id2page: dict[str, GoogleSearchResult] = {}
     cnt = 1
-    for query in queries:
-        res = service.cse().list(q=query, cx=CSE_ID, start=1, num=2, lr="lang_ja").execute()
-        items = []
-        urls = []
-        titles = []
-        for item in res["items"]:
-            if exist_urls and item["link"] in exist_urls:
-                continue
-            items.append(item)
-            urls.append(item["link"])
-            titles.append(item["title"])
-
-        max_workers = max(len(items), 1)
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            results = list(executor.map(_scrape_page, urls))
-        for url, title, result in zip(urls, titles, results, strict=False):
-            id_ = str(cnt).zfill(3)
-            id2page[id_] = GoogleSearchResult(url=url, title=title, body=result)
-            cnt += 1
+    for url, title, text in zip(urls, titles, texts, strict=True):
+        # 取得できなかったページは除く
+        if not text:
+            continue
+        id_ = str(cnt).zfill(3)
+        id2page[id_] = GoogleSearchResult(url=url, title=title, body=text)
+        cnt += 1
     return id2page
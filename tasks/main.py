@@ -1,10 +1,15 @@
 import logging
+from collections.abc import Callable
+from typing import Any
 
 import flask
 import functions_framework
 from dotenv import load_dotenv
 from flask import Response
 
+from common.fanout import run_for_users, select_shard
+from common.firestore import get_all_user_ids
+from common.schemas import FanOutSummary
 from services.advice.advice import create_advice
 from services.crawl_events.crawl_events import crawl_events
 from services.create_initiatives.create_initiatives import create_initiatives
@@ -21,68 +26,84 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+def _get_request_json(request: flask.Request) -> dict:
+    content_type = request.headers["content-type"]
+    if content_type != "application/json":
+        raise ValueError("Content-Type is not application/json")
+    return request.get_json(silent=True) or {}
+
+
+def _get_shard(request_json: dict) -> tuple[int, int] | None:
+    """
+    リクエストボディからshard_index/shard_countを取得する
+    - どちらも指定されていない場合はシャーディングしない
+    """
+    if "shard_index" not in request_json and "shard_count" not in request_json:
+        return None
+    try:
+        shard_index = int(request_json["shard_index"])
+        shard_count = int(request_json["shard_count"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("shard_index and shard_count must be given together as integers") from e
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard: shard_index={shard_index}, shard_count={shard_count}")
+    return shard_index, shard_count
+
+
+def _run_for_all_users(handler: Callable[[str], Any], shard: tuple[int, int] | None) -> FanOutSummary:
+    """
+    user_idが指定されなかった場合に、全ユーザー (シャード指定時はそのシャードのユーザー) に対してhandlerを並列実行する
+    """
+    user_ids = get_all_user_ids()
+    if shard is None:
+        return run_for_users(user_ids, handler)
+    shard_index, shard_count = shard
+    shard_user_ids = select_shard(user_ids, shard_index, shard_count)
+    logger.info(f"Shard {shard_index}/{shard_count}: {len(shard_user_ids)} of {len(user_ids)} users")
+    summary = run_for_users(shard_user_ids, handler)
+    return summary.model_copy(update={"shard_index": shard_index, "shard_count": shard_count})
+
+
+def _summary_response(summary: FanOutSummary) -> tuple[str, int]:
+    # 全員が失敗した場合のみエラーとして返す (一部の失敗でジョブ全体を再実行させない)
+    all_failed = summary.total > 0 and summary.succeeded == 0
+    return (summary.model_dump_json(), 500 if all_failed else 200)
+
+
+def _dispatch(request: flask.Request, handler: Callable[[str], tuple[str, int]]) -> tuple[str, int]:
+    request_json = _get_request_json(request)
+    user_id = request_json.get("user_id")
+    if user_id:
+        return handler(user_id)
+    try:
+        shard = _get_shard(request_json)
+    except ValueError as e:
+        return (f"Error: {e}", 400)
+    return _summary_response(_run_for_all_users(handler, shard))
+
+
 @functions_framework.http
 def crawl_events_entry_point(request: flask.Request) -> tuple[str, int]:
     logger.info("Received request")
-    content_type = request.headers["content-type"]
-    if content_type == "application/json":
-        request_json = request.get_json(silent=True)
-        if request_json and "user_id" in request_json:
-            user_id = request_json["user_id"]
-            status = crawl_events(user_id)
-        else:
-            status = crawl_events()
-    else:
-        raise ValueError("Content-Type is not application/json")
-    return status
+    return _dispatch(request, crawl_events)
 
 
 @functions_framework.http
 def create_quest_entry_point(request: flask.Request) -> tuple[str, int]:
     logger.info("Received request")
-    content_type = request.headers["content-type"]
-    if content_type == "application/json":
-        request_json = request.get_json(silent=True)
-        if request_json and "user_id" in request_json:
-            user_id = request_json["user_id"]
-            status = create_quests(user_id)
-        else:
-            status = create_quests()
-    else:
-        raise ValueError("Content-Type is not application/json")
-    return status
+    return _dispatch(request, create_quests)
 
 
 @functions_framework.http
 def manuscript_entry_point(request: flask.Request) -> tuple[str, int]:
     logger.info("Received request")
-    content_type = request.headers["content-type"]
-    if content_type == "application/json":
-        request_json = request.get_json(silent=True)
-        if request_json and "user_id" in request_json:
-            user_id = request_json["user_id"]
-            status = create_manuscript(user_id)
-        else:
-            status = create_manuscript()
-    else:
-        raise ValueError("Content-Type is not application/json")
-    return status
+    return _dispatch(request, create_manuscript)
 
 
 @functions_framework.http
 def send_request_iot_entry_point(request: flask.Request) -> tuple[str, int]:
     logger.info("Received request for send_request_iot")
-    content_type = request.headers["content-type"]
-    if content_type == "application/json":
-        request_json = request.get_json(silent=True)
-        if request_json and "user_id" in request_json:
-            user_id = request_json["user_id"]
-            status = send_request_iot(user_id)
-        else:
-            status = send_request_iot()
-    else:
-        raise ValueError("Content-Type is not application/json")
-    return status
+    return _dispatch(request, send_request_iot)
 
 
 @functions_framework.http
@@ -105,62 +126,32 @@ def create_initiatives_entry_point(request: flask.Request) -> tuple[str, int]:
 @functions_framework.http
 def save_old_memory_entry_point(request: flask.Request) -> tuple[str, int]:
     logger.info("Received request for save_old_memory")
-    content_type = request.headers["content-type"]
-    if content_type == "application/json":
-        request_json = request.get_json(silent=True)
-        user_id = request_json.get("user_id") if request_json else None
-        if user_id:
-            status = save_old_memory(user_id)
-        else:
-            status = save_old_memory()
-    else:
-        raise ValueError("Content-Type is not application/json")
-    return status
+    return _dispatch(request, save_old_memory)
 
 
 @functions_framework.http
 def advice_entry_point(request: flask.Request) -> tuple[str, int]:
     logger.info("Received request for advice")
-    content_type = request.headers["content-type"]
-    if content_type == "application/json":
-        request_json = request.get_json(silent=True)
-        user_id = request_json.get("user_id") if request_json else None
-        if user_id:
-            status = create_advice(user_id)
-        else:
-            status = create_advice()
-    else:
-        raise ValueError("Content-Type is not application/json")
-    return status
+    return _dispatch(request, create_advice)
 
 
 @functions_framework.http
 def routine_entry_point(request: flask.Request) -> tuple[str, int]:
     logger.info("Received request for routine")
-    content_type = request.headers["content-type"]
-    if content_type == "application/json":
-        request_json = request.get_json(silent=True)
-        user_id = request_json.get("user_id") if request_json else None
-        if user_id:
-            status = routine(user_id)
-        else:
-            status = routine()
-    else:
-        raise ValueError("Content-Type is not application/json")
-    return status
+    return _dispatch(request, routine)
 
 
 @functions_framework.http
 def news_entry_point(request: flask.Request) -> Response:
     logger.info("Received request for news")
-    content_type = request.headers["content-type"]
-    if content_type == "application/json":
-        request_json = request.get_json(silent=True)
-        user_id = request_json.get("user_id") if request_json else None
-        if user_id:
-            signed_url = create_news_audio(user_id)
-        else:
-            signed_url = create_news_audio()
-    else:
-        raise ValueError("Content-Type is not application/json")
-    return flask.jsonify({"signed_url": signed_url})
+    request_json = _get_request_json(request)
+    user_id = request_json.get("user_id")
+    if user_id:
+        signed_url = create_news_audio(user_id)
+        return flask.jsonify({"signed_url": signed_url})
+    try:
+        shard = _get_shard(request_json)
+    except ValueError as e:
+        return Response(f"Error: {e}", status=400)
+    summary = _run_for_all_users(create_news_audio, shard)
+    return flask.jsonify(summary.model_dump())
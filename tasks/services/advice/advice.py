@@ -1,9 +1,7 @@
 import logging
-import os
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from google import genai
 from ulid import ulid
 
 from common.db import (
@@ -13,13 +11,13 @@ from common.db import (
     save_advice_to_db,
     search_memory,
 )
-from common.firestore import get_all_user_ids
+from common.gemini import create_client
 from common.schemas import Advice
 from services.advice.instruction import CREATE_ADVICE_INSTRUCTION
 
 logger = logging.getLogger(__name__)
 
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+client = create_client()
 
 
 def _generate_advice(career_goals: str, initiatives: str, tasks: str, memory: str) -> str:
@@ -42,16 +40,10 @@ def _generate_advice(career_goals: str, initiatives: str, tasks: str, memory: st
         return "エラーが発生しました"
 
 
-def create_advice(user_id: str | None = None) -> tuple[str, int]:
+def create_advice(user_id: str) -> tuple[str, int]:
     """
     ユーザーの情報をもとに、アドバイスを作成する
     """
-    if not user_id:
-        user_ids = get_all_user_ids()
-        for user_id in user_ids:
-            create_advice(user_id)
-        return ("OK", 200)
-
     logger.info(f"Creating advice for user: {user_id}")
     career_goals = fetch_career_goals_from_db(user_id)
     initiatives = fetch_initiatives_from_db(user_id)
@@ -1,19 +1,19 @@
 import logging
-import os
 from datetime import datetime
+from itertools import zip_longest
 from typing import Any, Literal
 from zoneinfo import ZoneInfo
 
-import requests
-from google import genai
 from ulid import ulid
 
+from common.connpass import CONNPASS_DESCRIPTION_MAX_CHARS, CONNPASS_MAX_EVENTS, search_events_many
 from common.db import (
-    fetch_information_urls,
     save_event_to_information,
     search_memory,
 )
-from common.firestore import get_all_user_ids
+from common.extract import EXTRACT_MAX_CHARS, extract_text
+from common.gemini import create_client
+from common.known_urls import KnownUrls
 from common.schemas import ConnpassSearchResult, Event, GoogleSearchResult, RecommendResult
 from common.tools import google_search
 from services.crawl_events.instruction import GENERATE_QUERIES_INSTRUCTION, RECOMMEND_INSTRUCTION
@@ -21,7 +21,7 @@ from services.crawl_events.instruction import GENERATE_QUERIES_INSTRUCTION, RECO
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+client = create_client()
 
 
 def _generate_queries(user_preferences: str, category: str) -> list[str]:
@@ -57,7 +57,7 @@ def _generate_recommend_results(
     for id, page in id2page.items():
         title = page.title[:1000]
         url = page.url[:1000]
-        body = page.body[:10000]
+        body = page.body[:EXTRACT_MAX_CHARS]
         pages.append(f"# ID: {id}\n### タイトル: {title}\n### URL: {url}\n### 本文:\n{body}\n")
     body = "\n---\n".join(pages)
 
@@ -114,58 +114,59 @@ def _gather_events(
     return events
 
 
-def _search_connpass(queries: list[str], exist_urls: list[str]) -> dict[str, ConnpassSearchResult]:
+def _search_connpass(queries: list[str], known_urls: KnownUrls) -> dict[str, ConnpassSearchResult]:
+    """
+    Connpassでイベントを検索し、レコメンドの候補を返す
+    - キーワードごとの検索は並行して実行し、同じキーワードの結果は他のユーザーと使い回す
+    - 候補は各キーワードから順番に1件ずつ選び、CONNPASS_MAX_EVENTS 件までにする
+    - 説明文はHTMLなので本文のテキストだけを取り出し、CONNPASS_DESCRIPTION_MAX_CHARS 文字までにする
+    """
     id2connpass: dict[str, ConnpassSearchResult] = {}
     cnt = 1
 
-    for query in queries:
-        url = f"https://connpass.com/api/v2/events/?keyword={query}"
-        try:
-            response = requests.get(url, headers={"X-API-Key": os.getenv("CONNPASS_API_KEY"), "User-Agent": "Mozilla/5.0"})
-            body = response.json()
-        except Exception as e:
-            logger.error(f"error: {e}")
+    events_per_query = search_events_many(queries)
+    for query, events in zip(queries, events_per_query, strict=True):
+        logger.info(f"connpass {query}: {len(events)} events")
+    all_events = [event for events in zip_longest(*events_per_query) for event in events if event is not None]
+    new_urls = set(known_urls.filter_new(event.get("url") for event in all_events if event.get("url")))
+
+    for event in all_events:
+        if cnt > CONNPASS_MAX_EVENTS:
+            break
+        url = event.get("url")
+        if url not in new_urls:
             continue
-
-        events = body.get("events", [])
-        logger.info(f"events: {events}")
-
-        for event in events:
-            url = event.get("url")
-            title = event.get("title") or ""
-            description = event.get("description") or ""
-            start_time = event.get("started_at") or ""
-            place = event.get("place") or ""
-            body = f"{description} | 開始時刻: {start_time} | 開催場所: {place}"
-
-            if url in exist_urls:
-                continue
-
-            logger.info(f"event: {event}")
-
-            id_ = str(cnt).zfill(3)
-            event = ConnpassSearchResult(
-                url=url,
-                title=title,
-                body=body,
-            )
-            id2connpass[id_] = event
-            exist_urls.append(url)
+        new_urls.discard(url)
+
+        title = event.get("title") or ""
+        description = extract_text((event.get("description") or "").encode("utf-8"), "utf-8", CONNPASS_DESCRIPTION_MAX_CHARS)
+        start_time = event.get("started_at") or ""
+        place = event.get("place") or ""
+        body = f"{description} | 開始時刻: {start_time} | 開催場所: {place}"
+
+        id_ = str(cnt).zfill(3)
+        id2connpass[id_] = ConnpassSearchResult(
+            url=url,
+            title=title,
+            body=body,
+        )
+        known_urls.add(url)
+        cnt += 1
 
     return id2connpass
 
 
-def recommend(user_preferences: str, user_id: str, urls: list[str]) -> list[Event]:
+def recommend(user_preferences: str, user_id: str, known_urls: KnownUrls) -> list[Event]:
     it_queries = _generate_queries(user_preferences, "IT")
     fun_queries = _generate_queries(user_preferences, "趣味")
     both_queries = it_queries + fun_queries
 
-    id2page: dict[str, GoogleSearchResult] = google_search(both_queries, urls)
+    id2page: dict[str, GoogleSearchResult] = google_search(both_queries, known_urls)
     recommend_mapping: dict[str, RecommendResult] = _generate_recommend_results(user_preferences, id2page)
     google_events = _gather_events(id2page, recommend_mapping, user_id)
 
     it_queries = [query.replace(" ", ",") for query in it_queries]
-    id2connpass = _search_connpass(it_queries, urls)
+    id2connpass = _search_connpass(it_queries, known_urls)
     recommend_mapping = _generate_recommend_results(user_preferences, id2connpass, fix_event_category=True)
     connpass_events = _gather_events(id2connpass, recommend_mapping, user_id)
 
@@ -173,7 +174,7 @@ def recommend(user_preferences: str, user_id: str, urls: list[str]) -> list[Even
     return events
 
 
-def crawl_events(user_id: str | None = None) -> tuple[str, int]:
+def crawl_events(user_id: str) -> tuple[str, int]:
     """
     ユーザーの好みをもとに、興味のありそうな情報をインターネットから取得する
 
@@ -183,13 +184,8 @@ def crawl_events(user_id: str | None = None) -> tuple[str, int]:
     Returns:
         tuple[str, int]: ステータスメッセージとHTTPステータスコード
     """
-    if not user_id:
-        user_ids = get_all_user_ids()
-        for user_id in user_ids:
-            crawl_events(user_id)
-        return ("OK", 200)
     user_preferences = search_memory(user_id)
-    urls = fetch_information_urls(user_id)
-    events = recommend(user_preferences, user_id, urls)
+    known_urls = KnownUrls(user_id)
+    events = recommend(user_preferences, user_id, known_urls)
     save_event_to_information(events)
     return ("OK", 200)
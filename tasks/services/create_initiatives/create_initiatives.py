@@ -1,18 +1,17 @@
 import logging
-import os
 from datetime import datetime
 from typing import Any
 from zoneinfo import ZoneInfo
 
-from google import genai
 from ulid import ulid
 
 from common.db import save_initiatives_to_db
+from common.gemini import create_client
 from common.schemas import Initiative, InitiativeResult
 
 logger = logging.getLogger(__name__)
 
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+client = create_client()
 
 CREATE_INITIATIVES_INSTRUCTION = """\
 ユーザーのキャリアゴール情報をもとに、その達成に向けた中期目標（initiative）を3件生成してください。
@@ -1,10 +1,8 @@
 import logging
-import os
 from datetime import datetime
 from typing import Any
 from zoneinfo import ZoneInfo
 
-from google import genai
 from ulid import ulid
 
 from common.db import (
@@ -13,13 +11,13 @@ from common.db import (
     save_quests_to_information,
     search_memory,
 )
-from common.firestore import get_all_user_ids
+from common.gemini import create_client
 from common.schemas import Quest, QuestResult
 from services.create_quests.instruction import CREATE_QUESTS_INSTRUCTION
 
 logger = logging.getLogger(__name__)
 
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+client = create_client()
 
 
 def _generate_quests(user_preferences: str, past_quests: str, initiatives: str) -> list[QuestResult]:
@@ -73,15 +71,10 @@ def _convert_quest_results_to_quests(quest_results: list[QuestResult], user_id:
     return quests
 
 
-def create_quests(user_id: str | None = None) -> tuple[str, int]:
+def create_quests(user_id: str) -> tuple[str, int]:
     """
     ユーザーの情報をもとに、クエストを作成する
     """
-    if not user_id:
-        user_ids = get_all_user_ids()
-        for user_id in user_ids:
-            create_quests(user_id)
-        return ("OK", 200)
     user_preferences = search_memory(user_id)
     initiatives = fetch_initiatives_from_db(user_id)
     past_quests = fetch_quests_from_information(user_id)
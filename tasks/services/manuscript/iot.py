@@ -1,7 +1,7 @@
 import requests
 
 from common.db import fetch_latest_manuscript_from_manuscripts
-from common.firestore import db, get_all_user_ids
+from common.firestore import db
 
 
 def get_user_iot_device_url(user_id: str) -> str | None:
@@ -12,15 +12,10 @@ def get_user_iot_device_url(user_id: str) -> str | None:
     return None
 
 
-def send_request_iot(user_id: str | None = None) -> tuple[str, int]:
+def send_request_iot(user_id: str) -> tuple[str, int]:
     """
     manuscriptsテーブルから最新のmanuscriptを取得し、Firestoreの/users/userIdからiotDeviceUrlを取得し、そのURLにngrok経由でIoTサーバーに送信する
     """
-    if not user_id:
-        user_ids = get_all_user_ids()
-        for user_id in user_ids:
-            send_request_iot(user_id)
-        return ("OK", 200)
     iot_device_url = get_user_iot_device_url(user_id)
     if not iot_device_url:
         return ("iotDeviceUrl not found", 404)
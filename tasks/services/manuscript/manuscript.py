@@ -1,13 +1,11 @@
 import logging
-import os
 import random
 from datetime import datetime
 
-from google import genai
 from ulid import ulid
 
 from common.db import fetch_today_tasks, fetch_top3_today_information, save_manuscript_to_manuscripts
-from common.firestore import get_all_user_ids
+from common.gemini import create_client
 from common.schemas import Manuscript
 from services.manuscript.characters import CHARACTERS
 from services.manuscript.instruction import INSTRUCTION
@@ -15,7 +13,7 @@ from services.manuscript.instruction import INSTRUCTION
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+client = create_client()
 
 
 def _rewrite_manuscript_with_character(manuscript_text: str, character_profile: str) -> str:
@@ -37,15 +35,10 @@ def _rewrite_manuscript_with_character(manuscript_text: str, character_profile:
     return response.text.strip()
 
 
-def create_manuscript(user_id: str | None = None) -> tuple[str, int]:
+def create_manuscript(user_id: str) -> tuple[str, int]:
     """
     今日のinformation, tasksから原稿を生成しmanuscriptsテーブルに保存する
     """
-    if not user_id:
-        user_ids = get_all_user_ids()
-        for user_id in user_ids:
-            create_manuscript(user_id)
-        return ("OK", 200)
     logger.info(f"Creating manuscript for user: {user_id}")
     info_list = fetch_top3_today_information(user_id)
     task_list = fetch_today_tasks(user_id)
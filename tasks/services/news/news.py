@@ -10,7 +10,6 @@ from dotenv import load_dotenv
 from google.cloud import storage  # type: ignore
 
 from common.db import fetch_latest_manuscript_from_manuscripts, update_manuscript_audio_to_db
-from common.firestore import get_all_user_ids
 
 load_dotenv()
 
@@ -19,6 +18,8 @@ logger.setLevel(logging.INFO)
 
 NIJIVOICE_API_KEY = os.getenv("NIJIVOICE_API_KEY")
 GCS_BUCKET_NAME = os.getenv("NEWS_GCS_BUCKET_NAME")
+# にじボイスへのリクエストのタイムアウト (秒)
+NIJIVOICE_TIMEOUT = float(os.getenv("NIJIVOICE_TIMEOUT", "60"))
 
 if not NIJIVOICE_API_KEY:
     raise ValueError("NIJIVOICE_API_KEY is not set")
@@ -42,6 +43,7 @@ def _generate_voice_data(manuscript: str, character_id: str) -> bytes | None:
             f"https://api.nijivoice.com/api/platform/v1/voice-actors/{character_id}/generate-voice",
             headers={"x-api-key": NIJIVOICE_API_KEY, "accept": "application/json", "content-type": "application/json"},
             data=json.dumps(body),
+            timeout=NIJIVOICE_TIMEOUT,
         )
         response.raise_for_status()
 
@@ -51,7 +53,7 @@ def _generate_voice_data(manuscript: str, character_id: str) -> bytes | None:
             return None
 
         logger.info(f"Downloading audio from にじボイス: {audio_file_url}")
-        audio_response = requests.get(audio_file_url)
+        audio_response = requests.get(audio_file_url, timeout=NIJIVOICE_TIMEOUT)
         audio_response.raise_for_status()
 
         return audio_response.content
@@ -95,17 +97,11 @@ def _upload_to_gcs_and_get_signed_url(data: bytes, user_id: str, manuscript_id:
         return None
 
 
-def create_news_audio(user_id: str | None = None) -> str:
+def create_news_audio(user_id: str) -> str:
     """
     ユーザーの最新の原稿から音声を生成し、GCSにアップロードする
     user_idは必須
     """
-    if not user_id:
-        user_ids = get_all_user_ids()
-        for uid in user_ids:
-            create_news_audio(uid)
-        return "OK"
-
     logger.info(f"Starting news audio creation for user: {user_id}")
 
     manuscript = fetch_latest_manuscript_from_manuscripts(user_id)
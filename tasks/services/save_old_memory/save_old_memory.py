@@ -1,19 +1,18 @@
 import logging
-import os
 from datetime import UTC, datetime, timedelta
 from typing import Any
 from zoneinfo import ZoneInfo
 
-from google import genai
 from ulid import ulid
 
 from common.db import save_memory_to_db, search_memory
-from common.firestore import db, get_all_user_ids, get_sessions_for_user, set_session_summary_flag
+from common.firestore import db, get_sessions_for_user, set_session_summary_flag
+from common.gemini import create_client
 from common.schemas import ExtractMemory, Memory
 
 logger = logging.getLogger(__name__)
 
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+client = create_client()
 
 SUMMARIZE_MEMORY_INSTRUCTION = """\
 ユーザーの会話メッセージ一覧の中から、今後のユーザー体験向上やパーソナライズに役立つ重要な情報・記憶すべき内容があるか判定して、あれば要約してください。
@@ -61,17 +60,11 @@ def _get_messages_for_session(user_id: str, session_id: str) -> list[str]:
     return [m.to_dict().get("content", "") for m in messages if m.to_dict().get("content")]
 
 
-def save_old_memory(user_id: str | None = None) -> tuple[str, int]:
+def save_old_memory(user_id: str) -> tuple[str, int]:
     """
     3日以上前の全セッションのメッセージをまとめて要約し、memoryテーブルに1件保存
     Firestoreのsessionドキュメントに{'summary': True}を書き込む
     """
-    if user_id is None:
-        user_ids = get_all_user_ids()
-        for user_id in user_ids:
-            save_old_memory(user_id)
-        return ("OK", 200)
-
     sessions = get_sessions_for_user(user_id)
     memories = search_memory(user_id)
     three_days_ago = datetime.now(UTC) - timedelta(days=3)